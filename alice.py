@@ -2,9 +2,17 @@ import sys
 import time
 from socket import socket
 
-from common import load_circuit_from_file, send_object, read_object, load_assignment_from_file, log
-from garbled_circuits.garbled_circuit import GarbledCircuit
+from common import load_circuit_from_file, send_message, read_expected_message, load_assignment_from_file, log, \
+    get_option, MESSAGE_OT_KEYS, MESSAGE_OT_CIPHERTEXTS, MESSAGE_GARBLED_CIRCUIT, MESSAGE_GARBLED_HEADER, \
+    MESSAGE_GARBLED_CHUNK, MESSAGE_GARBLED_END, MESSAGE_OT_EXTENSION_MATRIX, MESSAGE_OT_EXTENSION_CIPHERTEXTS, \
+    MESSAGE_OT_POOL_CORRECTIONS, MESSAGE_OT_POOL_CIPHERTEXTS, MESSAGE_HELLO, MESSAGE_BATCH_SIZE, BATCH_SIZE, \
+    MESSAGE_GARBLED_INPUTS, circuit_hash, load_batch_from_file
+from garbled_circuits.garbled_circuit import GarbledCircuit, GarbledChunk, DEFAULT_CHUNK_SIZE
+from garbled_circuits.garbled_gate import HALF_GATES
+from garbled_circuits.garbled_pool import GarbledPool, PregarbledCircuit
 from oblivious_transfer.oblivious_transfer import ObliviousTransfer
+from oblivious_transfer.ot_extension import OTExtension, OT_EXTENSION_THRESHOLD
+from oblivious_transfer.ot_pool import OTPool, PrecomputedOT, SENDER
 
 script_name = sys.argv[0]
 
@@ -23,53 +31,179 @@ def get_connection(host, port, max_retries=20, retry_delay=5):
 
 def handle_args():
     if len(sys.argv) < 5:
-        log("Usage: python alice.py <bob_host> <bob_port> <circuit_file> <assignment_file> [--verbose]")
+        log("Usage: python alice.py <bob_host> <bob_port> <circuit_file> <assignment_file> [--verbose] "
+            "[--no-stream] [--chunk-size=N] [--ot-extension-threshold=N] [--ot-pool=DIR] [--garbled-pool=DIR] [--batch] [--garble-workers=N] "
+            "[--lut=K] [--circuit-cache=DIR]")
 
     bob_host = sys.argv[1]
     bob_port = int(sys.argv[2])
     circuit_file = sys.argv[3]
     assignment_file = sys.argv[4]
     verbose = '--verbose' in sys.argv
-
-    return bob_host, bob_port, circuit_file, assignment_file, verbose
+    chunk_size = None if '--no-stream' in sys.argv else int(get_option('chunk-size', DEFAULT_CHUNK_SIZE))
+    ot_threshold = int(get_option('ot-extension-threshold', OT_EXTENSION_THRESHOLD))
+    pool = get_option('ot-pool')
+    pool = OTPool(pool, SENDER) if pool else None
+    garbled_pool = get_option('garbled-pool')
+    garbled_pool = GarbledPool(garbled_pool) if garbled_pool else None
+    batch = '--batch' in sys.argv
+    garble_workers = int(get_option('garble-workers', 1))
+    lut = get_option('lut')
+    lut = int(lut) if lut else None
+    circuit_cache = get_option('circuit-cache')
+
+    return bob_host, bob_port, circuit_file, assignment_file, verbose, chunk_size, ot_threshold, pool, garbled_pool, \
+        batch, garble_workers, lut, circuit_cache
 
 def generate_passwords(terminals):
+    offset = GarbledCircuit.random_offset()
     passwords = {
-        t: [GarbledCircuit.random_password(), GarbledCircuit.random_password()]
+        t: GarbledCircuit.random_password_pair(offset)
         for t in terminals
     }
 
     return passwords
 
-def alice2bob(circuit, alice_assignment, keys, bob_terminals, verbose=False):
-    if len(keys) != len(bob_terminals):
-        raise ValueError("Bob asked for incorrect number of passwords")
+def alice2bob(circuit, alice_assignment, passwords, chunk_size=None, workers=None):
+    """
+    Garbles the circuit with the passwords of Bob's terminals, on workers processes if more than one.
+    Returns the lazy garbled circuit stream (see GarbledCircuit.garble_stream).
+    """
+    return GarbledCircuit.garble_stream(circuit, alice_assignment, passwords, mode=HALF_GATES, chunk_size=chunk_size,
+                                        workers=workers)
+
+def take_pregarbled_circuit(garbled_pool, digest, circuit, verbose=False, workers=None):
+    """
+    Takes a pre-garbled circuit from the pool, or garbles one now if the pool has none left.
+    """
+    instance = garbled_pool.take(digest)
+    if instance is None:
+        log(f"No pre-garbled circuit left in {garbled_pool.path}, garbling online")
+        instance = PregarbledCircuit.garble(circuit, workers=workers)
+    elif verbose:
+        log(f"Took a pre-garbled circuit from {garbled_pool.path}")
+    return instance
+
+def send_pregarbled_circuit(connection, instance, alice_assignment, verbose=False):
+    """
+    Sends the passwords of Alice's assignment, then the pre-garbled circuit.
+    """
+    payload = GarbledCircuit.serialize_passwords(instance.input_passwords(alice_assignment))
+    send_message(connection, MESSAGE_GARBLED_INPUTS, payload, verbose)
+    send_message(connection, MESSAGE_GARBLED_CIRCUIT, instance.garbled_circuit, verbose)
+
+def send_passwords(connection, passwords, bob_terminals, ot_threshold=OT_EXTENSION_THRESHOLD, verbose=False,
+                   pool=None):
+    """
+    Sends the passwords of Bob's terminals by oblivious transfer, in the order of the sorted terminals.
+    With a pool, precomputed random OTs are used (see ot_pool.py). Otherwise uses one public key OT
+    per terminal, or OT extension if Bob has at least ot_threshold terminals.
+    If Bob asks for no segments although he has terminals, his pool is exhausted and live OTs are used.
+    """
+    terminals = sorted(bob_terminals)
+    if pool is not None:
+        # Round 1: Bob -> Alice
+        payload = read_expected_message(connection, MESSAGE_OT_POOL_CORRECTIONS, verbose=verbose)
+        segments, payload = OTPool.deserialize_segments(payload)
+        if not segments and terminals:
+            log("Bob's OT pool is exhausted, using live oblivious transfers")
+            return send_passwords(connection, passwords, bob_terminals, ot_threshold, verbose)
+        if sum(count for _, _, count in segments) != len(terminals):
+            raise ValueError("Bob asked for incorrect number of passwords")
+        corrections = PrecomputedOT.deserialize_corrections(payload, len(terminals))
+        entries = pool.take_segments(segments)
+
+        # Round 2: Alice -> Bob
+        ciphertexts = PrecomputedOT.alice_ot1([passwords[t] for t in terminals], entries, corrections)
+        send_message(connection, MESSAGE_OT_POOL_CIPHERTEXTS, OTExtension.serialize_ciphertexts(ciphertexts), verbose)
+        return
+
+    if len(terminals) < ot_threshold:
+        # Round 1: Bob -> Alice
+        keys = ObliviousTransfer.deserialize_keys(read_expected_message(connection, MESSAGE_OT_KEYS, verbose=verbose))
+        if len(keys) != len(terminals):
+            raise ValueError("Bob asked for incorrect number of passwords")
+
+        # Round 2: Alice -> Bob
+        ciphertexts = ObliviousTransfer(2).alice_ot1_batch([passwords[t] for t in terminals], keys)
+        send_message(connection, MESSAGE_OT_CIPHERTEXTS, ObliviousTransfer.serialize_ciphertexts(ciphertexts), verbose)
+        return
+
+    # Round 0: Alice -> Bob, Alice is the receiver of the base OTs
+    ext = OTExtension()
+    base_keys, state = ext.alice_ext1()
+    send_message(connection, MESSAGE_OT_KEYS, ObliviousTransfer.serialize_keys(base_keys), verbose)
 
-    passwords = generate_passwords(bob_terminals)
-    garbled_circuit = GarbledCircuit.garble(circuit, alice_assignment, passwords)
+    # Round 1: Bob -> Alice
+    payload = read_expected_message(connection, MESSAGE_OT_CIPHERTEXTS, verbose=verbose)
+    base_ciphertexts = ObliviousTransfer.deserialize_ciphertexts(payload)
+    u, m = OTExtension.deserialize_matrix(read_expected_message(connection, MESSAGE_OT_EXTENSION_MATRIX, verbose=verbose))
+    if m != len(terminals):
+        raise ValueError("Bob asked for incorrect number of passwords")
 
+    # Round 2: Alice -> Bob
+    ciphertexts = ext.alice_ext2([passwords[t] for t in terminals], state, base_ciphertexts, u)
+    send_message(connection, MESSAGE_OT_EXTENSION_CIPHERTEXTS, OTExtension.serialize_ciphertexts(ciphertexts), verbose)
+
+def send_garbled_circuit(connection, stream, chunk_size=None, verbose=False):
+    """
+    Sends the garbled circuit to Bob.
+    With a chunk_size, the header is sent first and every chunk is sent as soon as it is garbled,
+    so Bob evaluates while Alice is still garbling. Otherwise the whole garbled circuit is sent in one message.
+    """
+    if chunk_size is None:
+        garbled_circuit = GarbledCircuit.from_stream(stream)
+        if verbose:
+            log(f"Garbled {len(garbled_circuit.gates)} gates")
+        send_message(connection, MESSAGE_GARBLED_CIRCUIT, garbled_circuit.serialize(), verbose)
+        return
+
+    send_message(connection, MESSAGE_GARBLED_HEADER, next(stream).serialize(), verbose)
+    n_gates = 0
+    for item in stream:
+        if isinstance(item, GarbledChunk):
+            n_gates += len(item.gates)
+            send_message(connection, MESSAGE_GARBLED_CHUNK, item.serialize())
+        else:
+            send_message(connection, MESSAGE_GARBLED_END, GarbledCircuit.serialize_output(item), verbose)
     if verbose:
-        log(f"Generated Passwords: {passwords}")
-    ot = ObliviousTransfer(2)
-    ciphertexts = [ot.alice_ot1(passwords[t], keys[i]) for i, t in enumerate(sorted(bob_terminals))]
-    message = (ciphertexts, garbled_circuit)
-    return message
-
-
-
+        log(f"Garbled and streamed {n_gates} gates")
 
 if __name__ == '__main__':
-    bob_host, bob_port, circuit_file, alice_assignment_file, verbose = handle_args()
+    bob_host, bob_port, circuit_file, alice_assignment_file, verbose, chunk_size, ot_threshold, pool, garbled_pool, \
+        batch, garble_workers, lut, circuit_cache = handle_args()
     connection = get_connection(bob_host, bob_port)
-
-    circuit, alice_terminals, bob_terminals = load_circuit_from_file(circuit_file)
-    alice_assignment = load_assignment_from_file(alice_assignment_file, alice_terminals)
-
-
-    # Round 1: Bob -> Alice
-    keys = read_object(connection, verbose=verbose)
-
-    # Round 2: Alice -> Bob
-    message = alice2bob(circuit, alice_assignment, keys, bob_terminals, verbose=verbose)
-    send_object(connection, message, verbose=verbose)
-
+    digest = circuit_hash(circuit_file)
+    send_message(connection, MESSAGE_HELLO, digest, verbose)
+
+    circuit, alice_terminals, bob_terminals = load_circuit_from_file(circuit_file, lut=lut, verbose=verbose,
+                                                                     cache_dir=circuit_cache, digest=digest)
+    if batch:
+        alice_assignments = load_batch_from_file(alice_assignment_file, alice_terminals)
+        send_message(connection, MESSAGE_BATCH_SIZE, BATCH_SIZE.pack(len(alice_assignments)), verbose)
+    else:
+        alice_assignments = [load_assignment_from_file(alice_assignment_file, alice_terminals)]
+    if verbose:
+        log(f"Circuit has {circuit.compiled.n_gates} gates, evaluating {len(alice_assignments)} assignments")
+
+    # Every evaluation is garbled with its own passwords
+    if garbled_pool is not None:
+        instances = [take_pregarbled_circuit(garbled_pool, digest, circuit, verbose, garble_workers)
+                     for _ in alice_assignments]
+        instance_passwords = [{t: instance.passwords[t] for t in bob_terminals} for instance in instances]
+    else:
+        instance_passwords = [generate_passwords(bob_terminals) for _ in alice_assignments]
+    if verbose:
+        log(f"Generated Passwords: {instance_passwords}")
+
+    # Rounds 1 and 2: oblivious transfer of the passwords of Bob's terminals, for all evaluations at once
+    passwords = {(i, t): pair for i, p in enumerate(instance_passwords) for t, pair in p.items()}
+    send_passwords(connection, passwords, list(passwords), ot_threshold, verbose=verbose, pool=pool)
+
+    # Round 2: Alice -> Bob, Bob evaluates a garbled circuit while Alice garbles the next one
+    for i, alice_assignment in enumerate(alice_assignments):
+        if garbled_pool is not None:
+            send_pregarbled_circuit(connection, instances[i], alice_assignment, verbose)
+        else:
+            stream = alice2bob(circuit, alice_assignment, instance_passwords[i], chunk_size, garble_workers)
+            send_garbled_circuit(connection, stream, chunk_size, verbose=verbose)
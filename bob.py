@@ -1,11 +1,27 @@
+import asyncio
+import multiprocessing
+import os
+import signal
 import sys
 import socket
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from common import read_object, send_object, load_circuit_from_file, load_assignment_from_file, log
+from common import read_message, read_expected_message, send_message, load_assignment_from_file, log, \
+    load_batch_from_file, get_option, CircuitCache, MESSAGE_OT_KEYS, MESSAGE_OT_CIPHERTEXTS, MESSAGE_GARBLED_CIRCUIT, \
+    MESSAGE_GARBLED_HEADER, MESSAGE_GARBLED_CHUNK, MESSAGE_GARBLED_END, MESSAGE_OT_EXTENSION_MATRIX, \
+    MESSAGE_OT_EXTENSION_CIPHERTEXTS, MESSAGE_OT_POOL_CORRECTIONS, MESSAGE_OT_POOL_CIPHERTEXTS, MESSAGE_HELLO, \
+    MESSAGE_BATCH_SIZE, BATCH_SIZE, MESSAGE_GARBLED_INPUTS
+from garbled_circuits.garbled_circuit import GarbledCircuit, GarbledChunk, StreamingEvaluator, PARALLEL_THRESHOLD
 from oblivious_transfer.oblivious_transfer import ObliviousTransfer
+from oblivious_transfer.ot_extension import OTExtension, OT_EXTENSION_THRESHOLD
+from oblivious_transfer.ot_pool import OTPool, PrecomputedOT, RECEIVER
 
 script_name = sys.argv[0]
 
+# Defaults of the server mode (--serve)
+DEFAULT_MAX_SESSIONS = 16
+DEFAULT_TIMEOUT = 300  # seconds
+
 def get_connection(self_port):
     server = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
     params = ("localhost", self_port)
@@ -18,70 +34,273 @@ def get_connection(self_port):
 
 def handle_args():
     if len(sys.argv) < 4:
-        log("Usage: python bob.py <bob_port> <circuit_file> <bob_assignment_file> [--verbose]")
+        log("Usage: python bob.py <bob_port> <circuit_file> <bob_assignment_file> [--verbose] "
+            "[--ot-extension-threshold=N] [--ot-pool=DIR] [--batch] [--eval-workers=N] [--eval-threshold=N] "
+            "[--serve] [--workers=N] [--max-sessions=N] [--timeout=S] [--circuit-cache=DIR]")
         sys.exit(1)
 
     bob_port = int(sys.argv[1])
     circuit_file = sys.argv[2]
     bobs_assignment_file = sys.argv[3]
     verbose = '--verbose' in sys.argv
-    return bob_port, circuit_file, bobs_assignment_file, verbose
+    ot_threshold = int(get_option('ot-extension-threshold', OT_EXTENSION_THRESHOLD))
+    pool = get_option('ot-pool')
+    pool = OTPool(pool, RECEIVER) if pool else None
+    batch = '--batch' in sys.argv
+    evaluation = {
+        'workers': int(get_option('eval-workers', 1)),
+        'threshold': int(get_option('eval-threshold', PARALLEL_THRESHOLD)),
+    }
+    server_options = None
+    if '--serve' in sys.argv:
+        server_options = {
+            'workers': int(get_option('workers', os.cpu_count())),
+            'max_sessions': int(get_option('max-sessions', DEFAULT_MAX_SESSIONS)),
+            'timeout': float(get_option('timeout', DEFAULT_TIMEOUT)),
+        }
+    cache = CircuitCache(get_option('circuit-cache'))
+    return bob_port, circuit_file, bobs_assignment_file, verbose, ot_threshold, pool, batch, evaluation, \
+        server_options, cache
 
 
 def bob2alice(circuit, bob_assignment):
     ot = ObliviousTransfer(2)
-    k = len(bob_assignment)
-
-    keys = []
-    sks = []
-    for t, v in sorted(bob_assignment.items()):
-        b, sk = ot.bob_ot1(v)
-        keys.append(b)
-        sks.append(sk)
-
-    return keys, sks
+    return ot.bob_ot1_batch([v for t, v in sorted(bob_assignment.items())])
 
 def recover_passwords(ciphertexts, sks, bob_assignment, verbose=False):
-    if len(keys) != len(bob_assignment) or len(ciphertexts) != len(bob_assignment):
+    if len(sks) != len(bob_assignment) or len(ciphertexts) != len(bob_assignment):
         raise ValueError("Incorrect number of passwords")
 
     ot = ObliviousTransfer(2)
-    input_passwords = {}
-    for i, (terminal, assignment) in enumerate(sorted(bob_assignment.items())):
-        c = int(assignment)
-        passwords = ciphertexts[i]
-        sk = sks[i]
-        password = ot.bob_ot2(c, sk, passwords)
-        input_passwords[terminal] = password
+    terminals, choices = zip(*sorted(bob_assignment.items())) if bob_assignment else ((), ())
+    input_passwords = dict(zip(terminals, ot.bob_ot2_batch(choices, sks, ciphertexts)))
 
     if verbose:
         log(f"Decoded Passwords: {input_passwords}")
 
     return input_passwords
 
+def receive_passwords(connection, bob_assignment, ot_threshold=OT_EXTENSION_THRESHOLD, verbose=False, pool=None):
+    """
+    Receives the passwords of Bob's terminals by oblivious transfer (see alice.send_passwords).
+    With a pool, precomputed random OTs are used (see ot_pool.py). Otherwise uses one public key OT
+    per terminal, or OT extension if Bob has at least ot_threshold terminals.
+    If the pool has too few random OTs left, Bob asks for no segments and both parties fall back to live OTs.
+    """
+    if pool is not None:
+        # Round 1: Bob -> Alice
+        terminals, choices = zip(*sorted(bob_assignment.items())) if bob_assignment else ((), ())
+        try:
+            segments, entries = pool.take(len(choices))
+        except ValueError as e:
+            log(f"{e}, using live oblivious transfers")
+            send_message(connection, MESSAGE_OT_POOL_CORRECTIONS, OTPool.serialize_segments([]), verbose)
+            return receive_passwords(connection, bob_assignment, ot_threshold, verbose)
+        corrections = PrecomputedOT.bob_ot1(choices, entries)
+        payload = OTPool.serialize_segments(segments) + PrecomputedOT.serialize_corrections(corrections)
+        send_message(connection, MESSAGE_OT_POOL_CORRECTIONS, payload, verbose)
 
-if __name__ == '__main__':
-    bob_port, circuit_file, bob_assignment_file, verbose = handle_args()
-    connection = get_connection(bob_port)
+        # Round 2: Alice -> Bob
+        payload = read_expected_message(connection, MESSAGE_OT_POOL_CIPHERTEXTS, verbose=verbose)
+        ciphertexts = OTExtension.deserialize_ciphertexts(payload)
+        input_passwords = dict(zip(terminals, PrecomputedOT.bob_ot2(choices, entries, ciphertexts)))
+        if verbose:
+            log(f"Decoded Passwords: {input_passwords}")
+        return input_passwords
+
+    if len(bob_assignment) < ot_threshold:
+        # Round 1: Bob -> Alice
+        keys, sks = bob2alice(None, bob_assignment)
+        send_message(connection, MESSAGE_OT_KEYS, ObliviousTransfer.serialize_keys(keys), verbose)
 
-    circuit, alice_terminals, bob_terminals = load_circuit_from_file(circuit_file)
-    bob_assignment = load_assignment_from_file(bob_assignment_file, bob_terminals)
+        # Round 2: Alice -> Bob
+        payload = read_expected_message(connection, MESSAGE_OT_CIPHERTEXTS, verbose=verbose)
+        ciphertexts = ObliviousTransfer.deserialize_ciphertexts(payload)
+        return recover_passwords(ciphertexts, sks, bob_assignment, verbose=verbose)
 
+    # Round 0: Alice -> Bob, Bob is the sender of the base OTs
+    ext = OTExtension()
+    base_keys = ObliviousTransfer.deserialize_keys(read_expected_message(connection, MESSAGE_OT_KEYS, verbose=verbose))
 
     # Round 1: Bob -> Alice
-    keys, sks = bob2alice(circuit, bob_assignment)
-    send_object(connection, keys, verbose=verbose)
+    terminals, choices = zip(*sorted(bob_assignment.items()))
+    base_ciphertexts, u, state = ext.bob_ext1(choices, base_keys)
+    send_message(connection, MESSAGE_OT_CIPHERTEXTS, ObliviousTransfer.serialize_ciphertexts(base_ciphertexts), verbose)
+    send_message(connection, MESSAGE_OT_EXTENSION_MATRIX, OTExtension.serialize_matrix(u, len(choices)), verbose)
+
+    # Round 2: Alice -> Bob
+    payload = read_expected_message(connection, MESSAGE_OT_EXTENSION_CIPHERTEXTS, verbose=verbose)
+    input_passwords = dict(zip(terminals, ext.bob_ext2(state, OTExtension.deserialize_ciphertexts(payload))))
+
+    if verbose:
+        log(f"Decoded Passwords: {input_passwords}")
+
+    return input_passwords
+
+def read_messages(connection, verbose=False):
+    while True:
+        yield read_message(connection, verbose=verbose)
+
+def evaluate_messages(messages, passwords, evaluation=None):
+    """
+    Evaluates a garbled circuit from the messages (type, payload) that carry it: a complete garbled circuit,
+    or the header of a stream followed by its chunks and output. A pre-garbled circuit is preceded by
+    the passwords of Alice's assignment. With a stream, every chunk is evaluated as soon as it is taken
+    from messages, which may be an iterator reading from the connection.
+    evaluation holds the workers and threshold of level-parallel evaluation (see StreamingEvaluator).
+    """
+    evaluation = evaluation or {}
+    messages = iter(messages)
+    message_type, payload = next(messages)
+    if message_type == MESSAGE_GARBLED_INPUTS:
+        alice_passwords, _ = GarbledCircuit.deserialize_passwords(payload)
+        if alice_passwords.keys() & passwords.keys():
+            raise ValueError("Alice sent passwords for Bob's terminals")
+        passwords = {**passwords, **alice_passwords}
+        message_type, payload = next(messages)
+    if message_type == MESSAGE_GARBLED_CIRCUIT:
+        return GarbledCircuit.deserialize(payload).evaluate(passwords, **evaluation)
+    if message_type != MESSAGE_GARBLED_HEADER:
+        raise ValueError(f"Unexpected message type: {message_type}")
+
+    evaluator = StreamingEvaluator(GarbledCircuit.deserialize(payload), passwords, **evaluation)
+    for message_type, payload in messages:
+        if message_type == MESSAGE_GARBLED_CHUNK:
+            evaluator.evaluate_chunk(GarbledChunk.deserialize(payload))
+        elif message_type == MESSAGE_GARBLED_END:
+            return evaluator.result(GarbledCircuit.deserialize_output(payload))
+        else:
+            raise ValueError(f"Unexpected message type: {message_type}")
+    raise ValueError("Garbled circuit stream ended without output")
+
+def receive_garbled_circuit(connection, verbose=False):
+    """
+    Reads all the messages of the garbled circuit, for evaluate_messages.
+    """
+    messages = [read_message(connection, verbose=verbose)]
+    while messages[-1][0] in [MESSAGE_GARBLED_INPUTS, MESSAGE_GARBLED_HEADER, MESSAGE_GARBLED_CHUNK]:
+        messages.append(read_message(connection, verbose=verbose))
+    return messages
+
+def bob_session(connection, circuit_file, bob_assignment_file, cache, ot_threshold=OT_EXTENSION_THRESHOLD,
+                pool=None, executor=None, batch=False, evaluation=None, verbose=False):
+    """
+    Runs a session with Alice on an accepted connection and returns the list of outputs of the circuit,
+    one per evaluation. With batch, bob_assignment_file is a batch of assignments (see load_batch_from_file)
+    and the circuit is evaluated with each of them, paired in order with the assignments of Alice's batch.
+    The circuit is parsed through the cache and the assignments are read again for every session.
+    With an executor, every garbled circuit is received completely and evaluated on the executor,
+    otherwise streamed chunks are evaluated as they arrive. evaluation is passed to evaluate_messages.
+    """
+    digest, circuit, alice_terminals, bob_terminals = cache.load(circuit_file, verbose)
+    if read_expected_message(connection, MESSAGE_HELLO, verbose=verbose) != digest:
+        raise ValueError("Alice uses a different circuit")
+    if batch:
+        bob_assignments = load_batch_from_file(bob_assignment_file, bob_terminals)
+        count, = BATCH_SIZE.unpack(read_expected_message(connection, MESSAGE_BATCH_SIZE, verbose=verbose))
+        if count != len(bob_assignments):
+            raise ValueError(f"Alice has {count} assignments, Bob has {len(bob_assignments)}")
+    else:
+        bob_assignments = [load_assignment_from_file(bob_assignment_file, bob_terminals)]
 
-    #Round 2: Alice -> Bob
-    ciphertexts, garbled_circuit = read_object(connection, verbose=verbose)
-    bob_passwords = recover_passwords(ciphertexts, sks, bob_assignment, verbose=verbose)
-    value = garbled_circuit.evaluate(bob_passwords)
+    # Rounds 1 and 2: oblivious transfer of the passwords of Bob's terminals, for all evaluations at once
+    assignment = {(i, t): v for i, a in enumerate(bob_assignments) for t, v in a.items()}
+    passwords = receive_passwords(connection, assignment, ot_threshold, verbose=verbose, pool=pool)
+    instance_passwords = [{t: passwords[(i, t)] for t in a} for i, a in enumerate(bob_assignments)]
 
+    # Round 2: Alice -> Bob, one garbled circuit per evaluation
+    if executor is None:
+        return [evaluate_messages(read_messages(connection, verbose), p, evaluation) for p in instance_passwords]
+    futures = [executor.submit(evaluate_messages, receive_garbled_circuit(connection, verbose), p, evaluation)
+               for p in instance_passwords]
+    return [future.result() for future in futures]
 
-    log(f"Output: {value}")
+def ignore_interrupts():
+    # Worker processes are stopped by the server, not by Ctrl-C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
 
+def format_output(value):
+    # A circuit with several outputs evaluates to a list of values
+    return ' '.join(map(str, value)) if type(value) == list else str(value)
 
+def log_outputs(values, batch, prefix=''):
+    if not batch:
+        log(f"{prefix}Output: {format_output(values[0])}")
+        return
+    for i, value in enumerate(values):
+        log(f"{prefix}Output {i}: {format_output(value)}")
 
+async def serve(port, circuit_file, bob_assignment_file, ot_threshold=OT_EXTENSION_THRESHOLD, pool=None,
+                batch=False, evaluation=None, workers=1, max_sessions=DEFAULT_MAX_SESSIONS, timeout=DEFAULT_TIMEOUT,
+                cache=None, verbose=False):
+    """
+    Evaluator server: runs sessions with many Alices concurrently, until interrupted.
+    Every session runs in a thread, with at most max_sessions at a time. Further connections are not
+    accepted until a session ends, they wait in the listen backlog. The garbled circuits are evaluated
+    on a process pool of workers processes, or in the session threads if workers is 0.
+    A session that takes longer than timeout seconds, or waits that long for a message, is closed.
+    Failed sessions are logged and do not stop the server.
+    """
+    loop = asyncio.get_running_loop()
+    cache = cache if cache is not None else CircuitCache()
+    # forkserver: the worker processes are started from session threads
+    context = multiprocessing.get_context('forkserver')
+    executor = ProcessPoolExecutor(workers, mp_context=context, initializer=ignore_interrupts) if workers > 0 else None
+    threads = ThreadPoolExecutor(max_sessions)
+    sessions = asyncio.Semaphore(max_sessions)
+    tasks = set()
 
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("localhost", port))
+    server.listen(max_sessions)
+    server.setblocking(False)
+    log(f"Serving on port {port}, at most {max_sessions} sessions at a time")
 
+    async def run_session(connection, addr):
+        try:
+            connection.setblocking(True)
+            connection.settimeout(timeout)
+            session = loop.run_in_executor(threads, bob_session, connection, circuit_file, bob_assignment_file,
+                                           cache, ot_threshold, pool, executor, batch, evaluation, verbose)
+            values = await asyncio.wait_for(session, timeout)
+            log_outputs(values, batch, f"Session {addr}: ")
+        except asyncio.TimeoutError:
+            log(f"Session {addr} timed out")
+        except Exception as e:
+            log(f"Session {addr} failed: {e!r}")
+        finally:
+            # Also ends a timed out session, whose thread fails on the closed socket
+            connection.close()
+            sessions.release()
 
+    try:
+        while True:
+            await sessions.acquire()
+            connection, addr = await loop.sock_accept(server)
+            log(f"Accepted connection from {addr}")
+            task = asyncio.create_task(run_session(connection, addr))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        server.close()
+        threads.shutdown(wait=False, cancel_futures=True)
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == '__main__':
+    bob_port, circuit_file, bob_assignment_file, verbose, ot_threshold, pool, batch, evaluation, server_options, \
+        cache = handle_args()
+    if server_options is not None:
+        try:
+            asyncio.run(serve(bob_port, circuit_file, bob_assignment_file, ot_threshold, pool, batch, evaluation,
+                              cache=cache, verbose=verbose, **server_options))
+        except KeyboardInterrupt:
+            log("Server stopped")
+        sys.exit(0)
+
+    connection = get_connection(bob_port)
+    values = bob_session(connection, circuit_file, bob_assignment_file, cache, ot_threshold, pool,
+                         batch=batch, evaluation=evaluation, verbose=verbose)
+    log_outputs(values, batch)
@@ -0,0 +1,188 @@
+from array import array
+from typing import Iterable, Iterator, List, Tuple
+
+from circuits.compiled import CompiledCircuit, GATE_CODES, LUT
+from circuits.elements import Terminal, NotGate, BufferGate, AndGate, OrGate, XorGate, XnorGate
+
+NOT, BUFFER, AND, OR, XOR, XNOR = [GATE_CODES[g] for g in [NotGate, BufferGate, AndGate, OrGate, XorGate, XnorGate]]
+
+
+def is_bristol(first_line: str) -> bool:
+    """
+    Returns True if the first line of a circuit file is the header of a Bristol Fashion circuit
+    (the number of gates and wires), which never starts a circuit in the text format.
+    """
+    tokens = first_line.split()
+    return len(tokens) == 2 and all(token.isdigit() for token in tokens)
+
+
+def input_name(value: int, bit: int) -> str:
+    """
+    Name of the terminal of the given bit of the given input value of a Bristol Fashion circuit, e.g. in0_3.
+    """
+    return f"in{value}_{bit}"
+
+
+def parse_bristol(lines: Iterable[str]) -> Tuple[CompiledCircuit, List[List[Terminal]]]:
+    """
+    Parses a circuit in Bristol Fashion, one line at a time:
+        <number of gates> <number of wires>
+        <number of input values> <bits of input value 1> ... <bits of input value n>
+        <number of output values> <bits of output value 1> ... <bits of output value m>
+        followed by one gate per line: <number of inputs> <number of outputs> <input wires> <output wires> <type>
+    The input values are on the first wires, the output values on the last wires, both in order.
+
+    Returns the compiled circuit and the terminals of every input value (named with input_name).
+    The outputs of the circuit are the bits of all output values, in order.
+
+    XOR, AND and INV gates map to XorGate, AndGate and NotGate, MAND to one AndGate per output.
+    EQW copies a wire and EQ sets it to a constant, an XOR or XNOR of the first input with itself.
+    """
+    lines = (line.split() for line in lines if line.strip())
+    n_gates, n_wires = _header(next(lines, None), 2, "gates and wires")
+    input_sizes = _sizes(next(lines, None), "input")
+    output_sizes = _sizes(next(lines, None), "output")
+
+    terminals = [[Terminal(input_name(i, j)) for j in range(size)] for i, size in enumerate(input_sizes)]
+    n_inputs = sum(input_sizes)
+    n_outputs = sum(output_sizes)
+    if n_inputs + n_outputs > n_wires:
+        raise ValueError("Bristol circuit has fewer wires than inputs and outputs")
+
+    # wires[w] is the wire of the compiled circuit for Bristol wire w, -1 until it is set
+    wires = array('q', [-1]) * n_wires
+    for w in range(n_inputs):
+        wires[w] = w
+    gate_types = array('B')
+    gate_offsets = array('I', [0])
+    gate_inputs = array('I')
+
+    def add(code, inputs):
+        gate_types.append(code)
+        gate_inputs.extend(inputs)
+        gate_offsets.append(len(gate_inputs))
+        return n_inputs + len(gate_types) - 1
+
+    def read(w):
+        if not 0 <= w < n_wires or wires[w] < 0:
+            raise ValueError(f"Bristol wire {w} is read before it is set")
+        return wires[w]
+
+    def write(w, wire):
+        if not 0 <= w < n_wires or wires[w] >= 0:
+            raise ValueError(f"Bristol wire {w} is out of range or set twice")
+        wires[w] = wire
+
+    for _ in range(n_gates):
+        tokens = next(lines, None)
+        if tokens is None:
+            raise ValueError("Bristol circuit has fewer gates than its header")
+        try:
+            n_in, n_out = int(tokens[0]), int(tokens[1])
+            ins = [int(x) for x in tokens[2:2 + n_in]]
+            outs = [int(x) for x in tokens[2 + n_in:2 + n_in + n_out]]
+        except (ValueError, IndexError):
+            raise ValueError(f"Invalid Bristol gate: {' '.join(tokens)}")
+        gate_type = tokens[-1]
+        if len(tokens) != 3 + n_in + n_out:
+            raise ValueError(f"Invalid Bristol gate: {' '.join(tokens)}")
+
+        if gate_type in ['XOR', 'AND'] and (n_in, n_out) == (2, 1):
+            write(outs[0], add(XOR if gate_type == 'XOR' else AND, [read(ins[0]), read(ins[1])]))
+        elif gate_type == 'INV' and (n_in, n_out) == (1, 1):
+            write(outs[0], add(NOT, [read(ins[0])]))
+        elif gate_type == 'EQW' and (n_in, n_out) == (1, 1):
+            write(outs[0], read(ins[0]))
+        elif gate_type == 'EQ' and (n_in, n_out) == (1, 1) and ins[0] in [0, 1]:
+            if n_inputs == 0:
+                raise ValueError("Constants need a circuit with at least one input")
+            write(outs[0], add(XNOR if ins[0] else XOR, [0, 0]))
+        elif gate_type == 'MAND' and n_in == 2 * n_out:
+            for i in range(n_out):
+                write(outs[i], add(AND, [read(ins[i]), read(ins[n_out + i])]))
+        else:
+            raise ValueError(f"Unsupported Bristol gate: {' '.join(tokens)}")
+
+    if next(lines, None) is not None:
+        raise ValueError("Bristol circuit has more gates than its header")
+    outputs = [read(w) for w in range(n_wires - n_outputs, n_wires)]
+    compiled = CompiledCircuit([t for value in terminals for t in value], gate_types, gate_offsets, gate_inputs,
+                               outputs)
+    return compiled, terminals
+
+
+def serialize_bristol(compiled: CompiledCircuit, inputs: List[List[Terminal]]) -> Iterator[str]:
+    """
+    Writes a compiled circuit in Bristol Fashion (see parse_bristol), one line at a time.
+    inputs are the terminals of every input value, in order, together all the terminals of the circuit.
+    The outputs of the circuit form a single output value.
+
+    XNOR is written as XOR and INV, OR as (a ^ b) ^ (a & b), which has a single AND gate.
+    Buffer gates are dropped. The outputs are copied to the last wires with EQW gates.
+    Lookup table gates have no Bristol equivalent and raise ValueError.
+    """
+    order = [t for value in inputs for t in value]
+    position = {t: i for i, t in enumerate(order)}
+    if len(position) != len(order) or set(order) != set(compiled.terminals):
+        raise ValueError("The input values must hold every terminal of the circuit exactly once")
+
+    live = compiled.reachable()
+    n_terminals = compiled.n_terminals
+    wires = [position[t] for t in compiled.terminals] + [None] * compiled.n_gates
+    n_wires = len(order)
+    gates = []
+
+    def gate(gate_type, *inputs):
+        nonlocal n_wires
+        gates.append(f"{len(inputs)} 1 {' '.join(map(str, inputs))} {n_wires} {gate_type}")
+        n_wires += 1
+        return n_wires - 1
+
+    for g in range(compiled.n_gates):
+        wire = n_terminals + g
+        if not live[wire]:
+            continue
+        code = compiled.gate_types[g]
+        ins = [wires[w] for w in compiled.inputs(g)]
+        if code == NOT:
+            wires[wire] = gate('INV', *ins)
+        elif code == BUFFER:
+            wires[wire] = ins[0]
+        elif code == AND:
+            wires[wire] = gate('AND', *ins)
+        elif code == XOR:
+            wires[wire] = gate('XOR', *ins)
+        elif code == XNOR:
+            wires[wire] = gate('INV', gate('XOR', *ins))
+        elif code == OR:
+            wires[wire] = gate('XOR', gate('XOR', *ins), gate('AND', *ins))
+        elif code == LUT:
+            raise ValueError("Lookup table gates cannot be written in Bristol Fashion")
+        else:
+            raise ValueError(f"Unsupported gate type code: {code}")
+
+    for w in compiled.outputs:
+        gates.append(f"1 1 {wires[w]} {n_wires} EQW")
+        n_wires += 1
+
+    yield f"{len(gates)} {n_wires}"
+    yield ' '.join(map(str, [len(inputs)] + [len(value) for value in inputs]))
+    yield f"1 {len(compiled.outputs)}"
+    yield ""
+    yield from gates
+
+
+def _header(tokens, count, description) -> List[int]:
+    if tokens is None or len(tokens) != count or not all(token.isdigit() for token in tokens):
+        raise ValueError(f"Invalid Bristol header, expected the number of {description}")
+    return [int(token) for token in tokens]
+
+
+def _sizes(tokens, description) -> List[int]:
+    """
+    Parses a line with a number of values followed by their sizes.
+    """
+    if tokens is None or not tokens or not all(token.isdigit() for token in tokens) or \
+            int(tokens[0]) != len(tokens) - 1:
+        raise ValueError(f"Invalid Bristol {description} sizes")
+    return [int(token) for token in tokens[1:]]
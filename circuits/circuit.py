@@ -1,10 +1,10 @@
-from circuits.elements import Terminal, NotGate, AndGate, OrGate, BufferGate
+from circuits.compiled import CompiledCircuit
 
 
 class Circuit:
     """
-    Represents a boolean circuit. A circuit can have multiple inputs but exactly one output.
-    We only keep the output gate/terminal in the circuit. The entire circuit is then recursively defined.
+    Represents a boolean circuit. A circuit can have multiple inputs and one or more outputs.
+    We only keep the output gates/terminals in the circuit. The entire circuit is then recursively defined.
 
     Example:
     a = Terminal('a')
@@ -17,17 +17,53 @@ class Circuit:
     circuit = Circuit([a, b, c], g3)
 
     This represents ((a & b) | ~c)
+
+    Circuit([a, b, c], [g1, g3]) has two outputs, (a & b) and ((a & b) | ~c). Methods returning the values of
+    the outputs return a list with one value per output for such circuits (see CompiledCircuit).
+
+    Internally, the circuit is also kept in a compiled form (see CompiledCircuit) which is used for
+    simplification and garbling. Circuits loaded with Circuit.deserialize only have the compiled form,
+    the gate objects are built on first access of circuit.outputs.
     """
 
-    def __init__(self, terminals, output):
+    def __init__(self, terminals, outputs):
         self.terminals = terminals
-        self.output = output
+        self._outputs = outputs if outputs is None or isinstance(outputs, list) else [outputs]
+        self._compiled = None
+
+    @staticmethod
+    def from_compiled(compiled: CompiledCircuit):
+        circuit = Circuit(compiled.terminals, None)
+        circuit._compiled = compiled
+        return circuit
+
+    @property
+    def outputs(self):
+        if self._outputs is None:
+            self._outputs = self._compiled.materialize()
+        return self._outputs
+
+    @property
+    def output(self):
+        """
+        The output of a circuit with a single output.
+        """
+        if len(self.outputs) != 1:
+            raise ValueError(f"The circuit has {len(self.outputs)} outputs, see outputs")
+        return self.outputs[0]
+
+    @property
+    def compiled(self) -> CompiledCircuit:
+        if self._compiled is None:
+            self._compiled = CompiledCircuit.from_circuit(self)
+        return self._compiled
 
     def __str__(self):
         """
         Returns a string representation of the circuit. Example: ((a & ~b) | ~c)
+        The outputs of a circuit with several outputs are separated by commas.
         """
-        return str(self.output)
+        return ', '.join(str(output) for output in self.outputs)
     
     def simplify(self, assignments):
         """
@@ -49,20 +85,11 @@ class Circuit:
 
         circuit.simplify({a:True, c:True}) will simplify ((True & b) | ~True) = (b | False) = b.
         The output will be the Terminal b.
-        """
-
-        return self.__dfs_simplify(self.output, assignments)
 
-        
-    def __dfs_simplify(self, node, assignments):
+        For a circuit with several outputs, returns the list of the simplified outputs.
         """
-        Helper function to recursively simplify the circuit.
-        """
-        if type(node) == Terminal:
-            return assignments.get(node, node)
-        else:
-            simplified_inputs = [self.__dfs_simplify(input, assignments) for input in node.inputs]
-            return node.simplify(*simplified_inputs)
+
+        return self.compiled.simplify(assignments)
 
     @staticmethod
     def deserialize(description: str):
@@ -73,8 +100,8 @@ class Circuit:
           - Each line represents a gate or terminal.
               - A terminal is represented in the following format: term identifier
               - A gate is represented in the following format: (gate_type input1 input2 ... inputN identifier)
-          - The representation ends with a line in the format: output identifier
-              - identifier is the identifier of the output terminal or gate.
+          - The representation ends with a line in the format: output identifier1 identifier2 ... identifierN
+              - the identifiers are those of the output terminals or gates, in order (at least one).
               - All subsequent lines are ignored.
           - Empty lines or lines starting with '#' are ignored.
 
@@ -88,87 +115,4 @@ class Circuit:
               output g3
           """
 
-        mapper = {}
-        terminals = []
-        output = None
-
-        for line in description.split('\n'):
-            if line.startswith('#') or not line:
-                continue
-
-            tokens = line.split()
-            line_type = tokens[0]
-
-            if line_type == 'term':
-                terminal, identifier = Circuit._handle_terminal_line(tokens, mapper)
-                terminals.append(terminal)
-                mapper[identifier] = terminal
-            elif line_type == 'output':
-                identifier = Circuit._handle_output_line(tokens, mapper)
-                output = mapper[identifier]
-                break
-            else:
-                gate, identifier = Circuit._handle_gate_line(tokens, mapper)
-                mapper[identifier] = gate
-
-        if output is None:
-            raise ValueError("Output identifier not found")
-
-        return Circuit(terminals, output)
-
-    @staticmethod
-    def _handle_output_line(tokens, mapper):
-        if len(tokens) != 2:
-            raise ValueError("Invalid format for output")
-        identifier = tokens[1]
-        if identifier not in mapper:
-            raise ValueError(f"Output identifier not found: {identifier}")
-        return identifier
-
-    @staticmethod
-    def _handle_terminal_line(tokens, mapper):
-        if len(tokens) != 2:
-            raise ValueError("Invalid format for terminal")
-        if mapper.get(tokens[1]) is not None:
-            raise ValueError(f"Duplicate identifier: {tokens[1]}")
-        name = tokens[1]
-        terminal = Terminal(name)
-        return terminal, name
-
-    @staticmethod
-    def _handle_gate_line(tokens, mapper):
-        if len(tokens) < 3:
-            raise ValueError("Invalid format for gate")
-
-        gate_type = tokens[0]
-        inputs = tokens[1:-1]
-        identifier = tokens[-1]
-
-        if identifier in mapper:
-            raise ValueError(f"Duplicate identifier: {identifier}")
-
-        for input in inputs:
-            if input not in mapper:
-                raise ValueError(f"Input identifier not found: {input}")
-
-        if gate_type.lower() == 'and':
-            if len(inputs) != 2:
-                raise ValueError("AND gate requires exactly 2 inputs")
-            gate = AndGate(mapper[inputs[0]], mapper[inputs[1]])
-        elif gate_type.lower() == 'or':
-            if len(inputs) != 2:
-                raise ValueError("OR gate requires exactly 2 inputs")
-            gate = OrGate(mapper[inputs[0]], mapper[inputs[1]])
-        elif gate_type.lower() == 'not':
-            if len(inputs) != 1:
-                raise ValueError("NOT gate requires exactly 1 input")
-            gate = NotGate(mapper[inputs[0]])
-        elif gate_type.lower() == 'buffer':
-            if len(inputs) != 1:
-                raise ValueError("Buffer gate requires exactly 1 input")
-            gate = BufferGate(mapper[inputs[0]])
-        else:
-            raise ValueError(f"Unsupported gate type: {gate_type}")
-
-        return gate, identifier
-
+        return Circuit.from_compiled(CompiledCircuit.deserialize(description))
@@ -0,0 +1,519 @@
+import struct
+import sys
+from array import array
+from itertools import chain, repeat
+from operator import lt, ne, sub
+from typing import List, Dict, Iterable
+
+from circuits.elements import Terminal, NotGate, AndGate, OrGate, BufferGate, XorGate, XnorGate, LutGate, LutType
+
+# Gate type codes used in the compiled representation. The code of a gate class is its index in this list.
+# The truth table of a LutGate is stored per gate, see CompiledCircuit.gate_type.
+GATE_TYPES = [NotGate, BufferGate, AndGate, OrGate, XorGate, XnorGate, LutGate]
+GATE_CODES = {cls: code for code, cls in enumerate(GATE_TYPES)}
+LUT = GATE_CODES[LutGate]
+# Number of inputs of the gates of each type code, None for lookup tables (any, given by their truth table)
+GATE_ARITIES = [1, 1, 2, 2, 2, 2, None]
+_ARITY_TABLE = bytes(arity or 0 for arity in GATE_ARITIES) + bytes(256 - len(GATE_ARITIES))
+
+# Binary encoding of a compiled circuit (see CompiledCircuit.to_bytes). It is in native byte order,
+# so that the arrays of a memory-mapped encoding are used in place (see CompiledCircuit.from_buffer).
+BINARY_MAGIC = b'GCCC'
+BINARY_VERSION = 1
+# magic, version, big-endian, number of terminals, gates, gate inputs, outputs and lookup tables
+BINARY_HEADER = struct.Struct('=4sBBxxIIIII')
+
+
+class CompiledCircuit:
+    """
+    Flat, topologically ordered representation of a boolean circuit.
+
+    Every wire is identified by an integer:
+        - wires 0 .. n_terminals-1 are the terminals, wire i is driven by terminals[i]
+        - wire n_terminals + j is the output of gate j
+
+    Gates are stored in topological order, i.e. every gate only reads wires with a smaller id.
+    So the circuit can be processed with a single loop over the gates, without recursion.
+
+    - gate_types[j] is the type code of gate j (an index into GATE_TYPES)
+    - the input wires of gate j are gate_inputs[gate_offsets[j]:gate_offsets[j + 1]]
+    - outputs are the wire ids of the outputs of the circuit, in order (a circuit has at least one)
+    - gate_tables[j] is the truth table of gate j if it is a LutGate (see LutType)
+
+    Example:
+        term a
+        term b
+        term c
+        and a b g1
+        not c g2
+        or g1 g2 g3
+        output g3
+
+    compiles to terminals = [a, b, c], gate_types = [AND, NOT, OR],
+    gate_offsets = [0, 2, 3, 5], gate_inputs = [0, 1, 2, 3, 4] and outputs = [5].
+
+    Methods returning the values of the outputs return a single value for a circuit with one output,
+    and a list with one value per output otherwise.
+    """
+
+    def __init__(self, terminals: List[Terminal], gate_types: array, gate_offsets: array, gate_inputs: array,
+                 outputs: List[int] | int, gate_tables: Dict[int, int] | None = None):
+        self.terminals = terminals
+        self.gate_types = gate_types
+        self.gate_offsets = gate_offsets
+        self.gate_inputs = gate_inputs
+        self.outputs = [outputs] if isinstance(outputs, int) else list(outputs)
+        self.gate_tables = gate_tables if gate_tables is not None else {}
+        if not self.outputs:
+            raise ValueError("A circuit needs at least one output")
+
+    @property
+    def n_terminals(self) -> int:
+        return len(self.terminals)
+
+    @property
+    def n_gates(self) -> int:
+        return len(self.gate_types)
+
+    @property
+    def n_wires(self) -> int:
+        return self.n_terminals + self.n_gates
+
+    @property
+    def output(self) -> int:
+        """
+        The wire id of the output of a circuit with a single output.
+        """
+        if len(self.outputs) != 1:
+            raise ValueError(f"The circuit has {len(self.outputs)} outputs, see outputs")
+        return self.outputs[0]
+
+    def output_values(self, values: List):
+        """
+        Picks the values of the outputs from the values of all wires (see the class docstring).
+        """
+        result = [values[w] for w in self.outputs]
+        return result[0] if len(result) == 1 else result
+
+    def inputs(self, gate: int) -> array:
+        """
+        Returns the input wires of the given gate.
+        """
+        return self.gate_inputs[self.gate_offsets[gate]:self.gate_offsets[gate + 1]]
+
+    def gate_type(self, gate: int):
+        """
+        Returns the type of the given gate: its gate class, or a LutType for a LutGate.
+        """
+        code = self.gate_types[gate]
+        if code == LUT:
+            return LutType(self.gate_tables[gate], self.gate_offsets[gate + 1] - self.gate_offsets[gate])
+        return GATE_TYPES[code]
+
+    def reachable(self) -> bytearray:
+        """
+        Returns a mask over the wires. mask[w] is 1 if wire w is in the cone of influence of an output.
+        """
+        mask = bytearray(self.n_wires)
+        for w in self.outputs:
+            mask[w] = 1
+        n_terminals = self.n_terminals
+        for gate in range(self.n_gates - 1, -1, -1):
+            if mask[n_terminals + gate]:
+                for wire in self.inputs(gate):
+                    mask[wire] = 1
+        return mask
+
+    def prune(self) -> 'CompiledCircuit':
+        """
+        Returns a copy of the circuit without the gates outside the cone of influence of the outputs.
+        The terminals are kept, the remaining gates keep their order.
+        """
+        live = self.reachable()
+        n_terminals = self.n_terminals
+        renumber = list(range(n_terminals)) + [None] * self.n_gates
+
+        gate_types = array('B')
+        gate_offsets = array('I', [0])
+        gate_inputs = array('I')
+        gate_tables = {}
+        for gate in range(self.n_gates):
+            wire = n_terminals + gate
+            if live[wire]:
+                if gate in self.gate_tables:
+                    gate_tables[len(gate_types)] = self.gate_tables[gate]
+                gate_types.append(self.gate_types[gate])
+                gate_inputs.extend(renumber[w] for w in self.inputs(gate))
+                gate_offsets.append(len(gate_inputs))
+                renumber[wire] = n_terminals + len(gate_types) - 1
+        return CompiledCircuit(self.terminals, gate_types, gate_offsets, gate_inputs,
+                               [renumber[w] for w in self.outputs], gate_tables)
+
+    def simplify(self, assignments: Dict[Terminal, bool]):
+        """
+        Same as Circuit.simplify, but iterates over the gates in topological order instead of recursing.
+        Gates outside the cone of influence of the outputs are skipped.
+        """
+        live = self.reachable()
+        values = [assignments.get(t, t) for t in self.terminals]
+        values.extend([None] * self.n_gates)
+
+        n_terminals = self.n_terminals
+        for gate in range(self.n_gates):
+            wire = n_terminals + gate
+            if live[wire]:
+                gate_type = self.gate_type(gate)
+                values[wire] = gate_type.simplify(*[values[w] for w in self.inputs(gate)])
+        return self.output_values(values)
+
+    def evaluate_batch(self, assignments: Dict[Terminal, int], n: int) -> int:
+        """
+        Evaluates the circuit on n assignments at once (bit-sliced evaluation).
+        assignments maps every terminal to an integer whose kth bit is the value of the terminal in the kth assignment.
+        Returns an integer whose kth bit is the output of the circuit for the kth assignment (one per output).
+
+        Each gate is evaluated with a single bitwise operation over all n assignments (see Gate.evaluate_bits).
+        """
+        for t in self.terminals:
+            if t not in assignments:
+                raise ValueError(f"Terminal {t} not found in assignments")
+        results = self._evaluate_bits([assignments[t] for t in self.terminals], (1 << n) - 1)
+        return results[0] if len(results) == 1 else results
+
+    def truth_table(self, chunk_inputs=20) -> List[int]:
+        """
+        Evaluates the circuit on all 2^n assignments of its n terminals.
+        Returns one integer per output, in order, whose kth bit is the value of the output for the assignment
+        terminals[i] = (k >> i) & 1.
+
+        The assignments are evaluated in chunks of 2^chunk_inputs to bound the size of the intermediate values.
+        """
+        n = self.n_terminals
+        chunk_inputs = min(n, chunk_inputs)
+        chunk_size = 1 << chunk_inputs
+        mask = (1 << chunk_size) - 1
+
+        # Within a chunk, the first chunk_inputs terminals take every combination of values.
+        patterns = []
+        for i in range(chunk_inputs):
+            pattern, length = ((1 << (1 << i)) - 1) << (1 << i), 2 << i
+            while length < chunk_size:
+                pattern |= pattern << length
+                length *= 2
+            patterns.append(pattern)
+
+        tables = [0] * len(self.outputs)
+        for chunk in range(1 << (n - chunk_inputs)):
+            # The remaining terminals are constant within a chunk.
+            values = patterns + [mask if chunk >> i & 1 else 0 for i in range(n - chunk_inputs)]
+            for i, table in enumerate(self._evaluate_bits(values, mask)):
+                tables[i] |= table << (chunk * chunk_size)
+        return tables
+
+    def _evaluate_bits(self, values, mask) -> List[int]:
+        """
+        Helper for bit-sliced evaluation. values holds the packed values of the terminals.
+        Returns the packed values of all outputs. Values of intermediate wires are dropped after their last use.
+        """
+        live = self.reachable()
+        n_terminals = self.n_terminals
+
+        last_use = [-1] * self.n_wires
+        for gate in range(self.n_gates):
+            if live[n_terminals + gate]:
+                for wire in self.inputs(gate):
+                    last_use[wire] = gate
+
+        outputs = set(self.outputs)
+        values = values + [None] * self.n_gates
+        for gate in range(self.n_gates):
+            wire = n_terminals + gate
+            if not live[wire]:
+                continue
+            input_wires = self.inputs(gate)
+            gate_type = self.gate_type(gate)
+            values[wire] = gate_type.evaluate_bits(mask, *[values[w] for w in input_wires])
+            for w in input_wires:
+                if last_use[w] == gate and w not in outputs:
+                    values[w] = None
+        return [values[w] for w in self.outputs]
+
+    def materialize(self):
+        """
+        Builds the Terminal/Gate object graph of the circuit and returns the output nodes, in order.
+        """
+        nodes = list(self.terminals)
+        for gate in range(self.n_gates):
+            gate_type = self.gate_type(gate)
+            nodes.append(gate_type(*[nodes[w] for w in self.inputs(gate)]))
+        return [nodes[w] for w in self.outputs]
+
+    @staticmethod
+    def from_circuit(circuit) -> 'CompiledCircuit':
+        """
+        Compiles the object graph of a Circuit.
+        The graph is traversed iteratively from the outputs, so each gate is compiled once and deep circuits
+        do not hit the recursion limit. Only gates in the cone of influence of the outputs are kept.
+        """
+        terminals = list(circuit.terminals)
+        wires = {t: i for i, t in enumerate(terminals)}
+        gate_wires = {}
+
+        gate_types = array('B')
+        gate_offsets = array('I', [0])
+        gate_inputs = array('I')
+        gate_tables = {}
+
+        def wire_of(node):
+            if type(node) == Terminal:
+                if node not in wires:
+                    raise ValueError(f"Terminal {node} is not a terminal of the circuit")
+                return wires[node]
+            return gate_wires.get(id(node))
+
+        stack = list(reversed(circuit.outputs))
+        while stack:
+            node = stack[-1]
+            if wire_of(node) is not None:
+                stack.pop()
+                continue
+
+            pending = [input for input in node.inputs if wire_of(input) is None]
+            if pending:
+                stack.extend(pending)
+                continue
+
+            stack.pop()
+            if type(node) not in GATE_CODES:
+                raise ValueError(f"Unsupported gate type: {type(node).__name__}")
+            if type(node) == LutGate:
+                gate_tables[len(gate_types)] = node.gate_type.table
+            gate_types.append(GATE_CODES[type(node)])
+            gate_inputs.extend(wire_of(input) for input in node.inputs)
+            gate_offsets.append(len(gate_inputs))
+            gate_wires[id(node)] = len(terminals) + len(gate_types) - 1
+
+        return CompiledCircuit(terminals, gate_types, gate_offsets, gate_inputs, [wire_of(x) for x in circuit.outputs],
+                               gate_tables)
+
+    def to_bytes(self) -> bytes:
+        """
+        Binary encoding of the circuit: the header (BINARY_HEADER), the names of the terminals separated by
+        newlines (preceded by their length), then gate_types, gate_offsets, gate_inputs, outputs and
+        the (gate, table) pairs of gate_tables as arrays of 32-bit integers (gate_types as bytes).
+        Every section starts at a multiple of 4 bytes.
+        """
+        if array('I').itemsize != 4:
+            raise ValueError("Binary compiled circuits need 32-bit unsigned integers")
+        names = '\n'.join(t.name for t in self.terminals).encode()
+        if any('\n' in t.name for t in self.terminals):
+            raise ValueError("Terminal names must not contain newlines")
+        tables = array('I', [x for gate, table in sorted(self.gate_tables.items()) for x in (gate, table)])
+
+        parts = [BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, sys.byteorder == 'big', self.n_terminals,
+                                    self.n_gates, len(self.gate_inputs), len(self.outputs), len(self.gate_tables)),
+                 array('I', [len(names)]).tobytes(), names, bytes(-len(names) % 4),
+                 bytes(self.gate_types), bytes(-self.n_gates % 4)]
+        parts.extend(array('I', section).tobytes()
+                     for section in [self.gate_offsets, self.gate_inputs, self.outputs])
+        parts.append(tables.tobytes())
+        return b''.join(parts)
+
+    @staticmethod
+    def from_buffer(buffer) -> 'CompiledCircuit':
+        """
+        Decodes to_bytes. The arrays of the circuit are views of buffer, not copies,
+        so a memory-mapped encoding is only read from disk as it is used.
+        Raises ValueError if the encoding is malformed or was written on a machine with another byte order.
+        The gates are checked as well (see _check_gates), so a corrupted encoding is rejected here
+        rather than failing during evaluation.
+        """
+        view = memoryview(buffer)
+        if len(view) < BINARY_HEADER.size:
+            raise ValueError("Truncated compiled circuit")
+        magic, version, big_endian, n_terminals, n_gates, n_inputs, n_outputs, n_tables = \
+            BINARY_HEADER.unpack_from(view, 0)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise ValueError("Invalid compiled circuit")
+        if big_endian != (sys.byteorder == 'big'):
+            raise ValueError("Compiled circuit has another byte order")
+
+        offset = BINARY_HEADER.size
+
+        def section(length, format):
+            nonlocal offset
+            if offset + length > len(view):
+                raise ValueError("Truncated compiled circuit")
+            result = view[offset:offset + length].cast(format)
+            offset += length + -length % 4
+            return result
+
+        names_length, = section(4, 'I')
+        names = bytes(section(names_length, 'B')).decode()
+        terminals = [Terminal(name) for name in names.split('\n')] if n_terminals else []
+        if len(terminals) != n_terminals:
+            raise ValueError("Invalid compiled circuit terminals")
+        gate_types = section(n_gates, 'B')
+        gate_offsets = section(4 * (n_gates + 1), 'I')
+        gate_inputs = section(4 * n_inputs, 'I')
+        outputs = section(4 * n_outputs, 'I')
+        tables = section(8 * n_tables, 'I')
+        if offset != len(view) or gate_offsets[n_gates] != n_inputs:
+            raise ValueError("Compiled circuit length does not match its header")
+        if any(w >= n_terminals + n_gates for w in outputs):
+            raise ValueError("Invalid compiled circuit outputs")
+        gate_tables = {tables[i]: tables[i + 1] for i in range(0, len(tables), 2)}
+        CompiledCircuit._check_gates(n_terminals, gate_types, gate_offsets, gate_inputs, gate_tables)
+        return CompiledCircuit(terminals, gate_types, gate_offsets, gate_inputs, list(outputs), gate_tables)
+
+    @staticmethod
+    def _check_gates(n_terminals, gate_types, gate_offsets, gate_inputs, gate_tables):
+        """
+        Checks the gates of a decoded circuit: known type codes with the right number of inputs, a truth table
+        of the right size for every lookup table and for lookup tables only, and input wires before the gate.
+        Raises ValueError otherwise.
+        The checks iterate in C (map, translate, chain) rather than in a loop over the gates, as they run
+        on every load of a cached circuit.
+        """
+        n_gates = len(gate_types)
+        types = gate_types.tobytes()
+        offsets = gate_offsets.tolist()
+        counts = list(map(sub, offsets[1:], offsets))
+        if offsets[0] != 0 or min(counts, default=0) < 0 or max(types, default=0) >= len(GATE_TYPES):
+            raise ValueError("Invalid compiled circuit gates")
+
+        if types.count(LUT) != len(gate_tables):
+            raise ValueError("Invalid compiled circuit lookup tables")
+        arities = counts
+        if gate_tables:
+            arities = counts.copy()
+            for gate, table in gate_tables.items():
+                if gate >= n_gates or types[gate] != LUT or not 1 <= counts[gate] or table >> (1 << counts[gate]):
+                    raise ValueError(f"Invalid compiled circuit lookup table {gate}")
+                arities[gate] = 0
+        if any(map(ne, arities, types.translate(_ARITY_TABLE))):
+            raise ValueError("Invalid number of inputs of a compiled circuit gate")
+
+        # Every input must be a wire before the gate that reads it
+        owners = chain.from_iterable(map(repeat, range(n_terminals, n_terminals + n_gates), counts))
+        if not all(map(lt, gate_inputs, owners)):
+            raise ValueError("A compiled circuit gate reads a later wire")
+
+    @staticmethod
+    def deserialize(description: str) -> 'CompiledCircuit':
+        """
+        Parses the textual circuit format (see Circuit.deserialize) directly into the compiled form,
+        without building Terminal/Gate objects for the gates.
+        """
+        return CompiledCircuit.parse(description.split('\n'))
+
+    @staticmethod
+    def parse(lines: Iterable[str]) -> 'CompiledCircuit':
+        """
+        Same as deserialize, but reads the description one line at a time from lines, e.g. the lines of a file,
+        so that the description is never held in memory as a whole. Stops after the output line,
+        the following lines are not read.
+        """
+
+        # While parsing, terminal k is referred to as -(k + 1) and gate j as j.
+        # They are renumbered to the final wire ids once the number of terminals is known.
+        mapper = {}
+        terminals = []
+        gate_types = array('B')
+        gate_offsets = array('I', [0])
+        gate_inputs = array('l')
+        outputs = None
+
+        for line in lines:
+            line = line.strip()
+            if line.startswith('#') or not line:
+                continue
+
+            tokens = line.split()
+            line_type = tokens[0]
+
+            if line_type == 'term':
+                identifier = CompiledCircuit._handle_terminal_line(tokens, mapper)
+                terminals.append(Terminal(identifier))
+                mapper[identifier] = -len(terminals)
+            elif line_type == 'output':
+                outputs = [mapper[identifier] for identifier in CompiledCircuit._handle_output_line(tokens, mapper)]
+                break
+            else:
+                code, inputs, identifier = CompiledCircuit._handle_gate_line(tokens, mapper)
+                gate_types.append(code)
+                gate_inputs.extend(mapper[input] for input in inputs)
+                gate_offsets.append(len(gate_inputs))
+                mapper[identifier] = len(gate_types) - 1
+
+        if outputs is None:
+            raise ValueError("Output identifier not found")
+
+        n_terminals = len(terminals)
+        renumber = lambda x: -x - 1 if x < 0 else n_terminals + x
+        gate_inputs = array('I', map(renumber, gate_inputs))
+
+        return CompiledCircuit(terminals, gate_types, gate_offsets, gate_inputs, [renumber(x) for x in outputs])
+
+    @staticmethod
+    def _handle_output_line(tokens, mapper):
+        if len(tokens) < 2:
+            raise ValueError("Invalid format for output")
+        identifiers = tokens[1:]
+        for identifier in identifiers:
+            if identifier not in mapper:
+                raise ValueError(f"Output identifier not found: {identifier}")
+        return identifiers
+
+    @staticmethod
+    def _handle_terminal_line(tokens, mapper):
+        if len(tokens) != 2:
+            raise ValueError("Invalid format for terminal")
+        if mapper.get(tokens[1]) is not None:
+            raise ValueError(f"Duplicate identifier: {tokens[1]}")
+        return tokens[1]
+
+    @staticmethod
+    def _handle_gate_line(tokens, mapper):
+        if len(tokens) < 3:
+            raise ValueError("Invalid format for gate")
+
+        gate_type = tokens[0]
+        inputs = tokens[1:-1]
+        identifier = tokens[-1]
+
+        if identifier in mapper:
+            raise ValueError(f"Duplicate identifier: {identifier}")
+
+        for input in inputs:
+            if input not in mapper:
+                raise ValueError(f"Input identifier not found: {input}")
+
+        if gate_type.lower() == 'and':
+            if len(inputs) != 2:
+                raise ValueError("AND gate requires exactly 2 inputs")
+            gate = AndGate
+        elif gate_type.lower() == 'or':
+            if len(inputs) != 2:
+                raise ValueError("OR gate requires exactly 2 inputs")
+            gate = OrGate
+        elif gate_type.lower() == 'xor':
+            if len(inputs) != 2:
+                raise ValueError("XOR gate requires exactly 2 inputs")
+            gate = XorGate
+        elif gate_type.lower() == 'xnor':
+            if len(inputs) != 2:
+                raise ValueError("XNOR gate requires exactly 2 inputs")
+            gate = XnorGate
+        elif gate_type.lower() == 'not':
+            if len(inputs) != 1:
+                raise ValueError("NOT gate requires exactly 1 input")
+            gate = NotGate
+        elif gate_type.lower() == 'buffer':
+            if len(inputs) != 1:
+                raise ValueError("Buffer gate requires exactly 1 input")
+            gate = BufferGate
+        else:
+            raise ValueError(f"Unsupported gate type: {gate_type}")
+
+        return GATE_CODES[gate], inputs, identifier
@@ -41,14 +41,34 @@ class Gate:
         """
         Returns a string representation of the output of the gate. Example: ((a & ~b) | ~c)
         """
-        class_name = self.__class__.__name__
-        inputs = ', '.join([str(x) for x in self.inputs])
+        return Gate._dfs_str(self, {})
 
-        return f"{class_name}({inputs})"
+    @staticmethod
+    def _dfs_str(node, cache):
+        """
+        Helper to recursively build the string representation.
+        cache maps id(node) -> string, so shared sub-circuits are only formatted once.
+        """
+        if not isinstance(node, Gate):
+            return str(node)
 
-    def simplify(self, *inputs):
+        key = id(node)
+        if key not in cache:
+            inputs = [Gate._dfs_str(x, cache) for x in node.inputs]
+            cache[key] = node._format(*inputs)
+        return cache[key]
+
+    def _format(self, *inputs):
+        """
+        Formats the gate given the string representations of its inputs.
+        """
+        class_name = self.__class__.__name__
+        return f"{class_name}({', '.join(inputs)})"
+
+    @classmethod
+    def simplify(cls, *inputs):
         """
-        Simplifies the circuit by recursively evaluating the inputs.
+        Simplifies the gate given its (already simplified) inputs. Each input is a boolean value, a terminal or a gate.
         The output is a boolean value or a gate whose output is the representation of the simplified circuit.
         """
 
@@ -62,19 +82,43 @@ class Gate:
         """
         raise NotImplemented("Subclasses should implement")
 
+    @classmethod
+    def evaluate_bits(cls, mask, *inputs):
+        """
+        Evaluates the gate on many assignments at once.
+        Each input is an integer whose kth bit is the value of the input in the kth assignment,
+        mask has a 1 bit for every assignment. Returns the outputs packed the same way.
+
+        The default implementation ORs together the rows of the truth table that are 1.
+        Subclasses override it with a single bitwise operation.
+        """
+        result = 0
+        for row, value in enumerate(cls.truth_table()):
+            if value:
+                term = mask
+                for i, x in enumerate(inputs):
+                    term &= x if row >> i & 1 else x ^ mask
+                result |= term
+        return result
+
 
 class NotGate(Gate):
     def __init__(self, input):
         super().__init__(input)
 
-    def __str__(self):
-        return f"~{self.inputs[0]}"
+    def _format(self, input):
+        return f"~{input}"
 
-    def simplify(self, input):
+    @classmethod
+    def simplify(cls, input):
         if type(input) == bool:
             return not input
         else:
-            return NotGate(input)
+            return cls(input)
+
+    @staticmethod
+    def evaluate_bits(mask, input):
+        return input ^ mask
 
     @staticmethod
     def truth_table():
@@ -85,14 +129,19 @@ class BufferGate(Gate):
     def __init__(self, input):
         super().__init__(input)
 
-    def __str__(self):
-        return f"{self.inputs[0]}"
+    def _format(self, input):
+        return f"{input}"
 
-    def simplify(self, input):
+    @classmethod
+    def simplify(cls, input):
         if type(input) == bool:
             return input
         else:
-            return BufferGate(input)
+            return cls(input)
+
+    @staticmethod
+    def evaluate_bits(mask, input):
+        return input
 
     @staticmethod
     def truth_table():
@@ -103,10 +152,11 @@ class AndGate(Gate):
     def __init__(self, input1, input2):
         super().__init__(input1, input2)
 
-    def __str__(self):
-        return f"({self.inputs[0]} & {self.inputs[1]})"
+    def _format(self, input1, input2):
+        return f"({input1} & {input2})"
 
-    def simplify(self, input1, input2):
+    @classmethod
+    def simplify(cls, input1, input2):
         if type(input1) == bool and type(input2) == bool:
             return input1 and input2
         elif type(input1) == bool:
@@ -120,7 +170,11 @@ class AndGate(Gate):
             else:
                 return input1
         else:
-            return AndGate(input1, input2)
+            return cls(input1, input2)
+
+    @staticmethod
+    def evaluate_bits(mask, input1, input2):
+        return input1 & input2
 
     @staticmethod
     def truth_table():
@@ -131,10 +185,11 @@ class OrGate(Gate):
     def __init__(self, input1, input2):
         super().__init__(input1, input2)
 
-    def __str__(self):
-        return f"({self.inputs[0]} | {self.inputs[1]})"
+    def _format(self, input1, input2):
+        return f"({input1} | {input2})"
 
-    def simplify(self, input1, input2):
+    @classmethod
+    def simplify(cls, input1, input2):
         if type(input1) == bool and type(input2) == bool:
             return input1 or input2
         elif type(input1) == bool:
@@ -148,8 +203,132 @@ class OrGate(Gate):
             else:
                 return input1
         else:
-            return OrGate(input1, input2)
+            return cls(input1, input2)
+
+    @staticmethod
+    def evaluate_bits(mask, input1, input2):
+        return input1 | input2
+
+    @staticmethod
+    def truth_table():
+        return [0, 1, 1, 1]
+
+class XorGate(Gate):
+    def __init__(self, input1, input2):
+        super().__init__(input1, input2)
+
+    def _format(self, input1, input2):
+        return f"({input1} ^ {input2})"
+
+    @classmethod
+    def simplify(cls, input1, input2):
+        if type(input1) == bool and type(input2) == bool:
+            return input1 != input2
+        elif type(input1) == bool:
+            return NotGate(input2) if input1 else input2
+        elif type(input2) == bool:
+            return NotGate(input1) if input2 else input1
+        else:
+            return cls(input1, input2)
+
+    @staticmethod
+    def evaluate_bits(mask, input1, input2):
+        return input1 ^ input2
 
     @staticmethod
     def truth_table():
-        return [0, 1, 1, 1]
\ No newline at end of file
+        return [0, 1, 1, 0]
+
+
+class XnorGate(Gate):
+    def __init__(self, input1, input2):
+        super().__init__(input1, input2)
+
+    def _format(self, input1, input2):
+        return f"~({input1} ^ {input2})"
+
+    @classmethod
+    def simplify(cls, input1, input2):
+        if type(input1) == bool and type(input2) == bool:
+            return input1 == input2
+        elif type(input1) == bool:
+            return input2 if input1 else NotGate(input2)
+        elif type(input2) == bool:
+            return input1 if input2 else NotGate(input1)
+        else:
+            return cls(input1, input2)
+
+    @staticmethod
+    def evaluate_bits(mask, input1, input2):
+        return input1 ^ input2 ^ mask
+
+    @staticmethod
+    def truth_table():
+        return [1, 0, 0, 1]
+
+
+class LutGate(Gate):
+    """
+    Gate with an arbitrary truth table over its inputs (a lookup table), see circuits.optimizer.fuse.
+    Unlike the other gates, the truth table belongs to the gate and not to its class:
+    gate_type is a LutType, which has the methods of the gate classes.
+    """
+    def __init__(self, gate_type, *inputs):
+        super().__init__(*inputs)
+        self.gate_type = gate_type
+
+    def _format(self, *inputs):
+        return f"lut{self.gate_type.table:x}({', '.join(inputs)})"
+
+
+class LutType:
+    """
+    Type of the LutGate objects with a given truth table over k inputs, used in place of a gate class:
+    LutType(table, k)(*inputs) is a LutGate, and truth_table, simplify and evaluate_bits work as for the gate classes.
+    table is an integer whose bit m is the output when input i has the value of bit i of m
+    (the row order of Gate.truth_table).
+    """
+    def __init__(self, table, k):
+        self.table = table
+        self.k = k
+
+    def __call__(self, *inputs):
+        return LutGate(self, *inputs)
+
+    def __eq__(self, other):
+        return isinstance(other, LutType) and (self.table, self.k) == (other.table, other.k)
+
+    def __hash__(self):
+        return hash((self.table, self.k))
+
+    def __repr__(self):
+        return f"LutType({self.table:#x}, {self.k})"
+
+    def truth_table(self):
+        return [self.table >> m & 1 for m in range(1 << self.k)]
+
+    def simplify(self, *inputs):
+        free = [i for i, x in enumerate(inputs) if type(x) != bool]
+        set_bits = sum(1 << i for i, x in enumerate(inputs) if x is True)
+
+        # Truth table over the inputs that are not fixed
+        table = 0
+        for m in range(1 << len(free)):
+            row = set_bits | sum(1 << free[j] for j in range(len(free)) if m >> j & 1)
+            table |= (self.table >> row & 1) << m
+
+        if table == 0 or table == (1 << (1 << len(free))) - 1:
+            return table != 0
+        if len(free) == 1:
+            return inputs[free[0]] if table == 0b10 else NotGate(inputs[free[0]])
+        return LutType(table, len(free))(*[inputs[i] for i in free])
+
+    def evaluate_bits(self, mask, *inputs):
+        result = 0
+        for row in range(1 << self.k):
+            if self.table >> row & 1:
+                term = mask
+                for i, x in enumerate(inputs):
+                    term &= x if row >> i & 1 else x ^ mask
+                result |= term
+        return result
@@ -0,0 +1,207 @@
+from array import array
+from typing import List
+
+from circuits.compiled import CompiledCircuit, GATE_CODES, LUT
+from circuits.elements import NotGate, BufferGate, AndGate, OrGate, XorGate, XnorGate
+
+NOT, BUFFER, AND, OR, XOR, XNOR = [GATE_CODES[g] for g in [NotGate, BufferGate, AndGate, OrGate, XorGate, XnorGate]]
+
+# Largest number of inputs of the lookup tables built by fuse. A table is stored in 2^k bits.
+MAX_LUT_INPUTS = 4
+
+
+def optimize(compiled: CompiledCircuit) -> CompiledCircuit:
+    """
+    Structural optimization of a compiled circuit. Returns an equivalent circuit with the same terminals
+    and outputs, in the same order, and at most as many gates:
+        - gates outside the cone of influence of the outputs are removed
+        - BUFFER gates are removed, their consumers read their input
+        - NOT gates are absorbed into the polarity of their input: NOT of NOT is nothing, and a negated input
+          or output of an XOR/XNOR gate turns it into the other type. A NOT gate is only kept where a negated
+          value is read by an AND/OR gate or is an output, and then once per wire
+        - structurally identical gates (same type and inputs, in any order) are merged (hash-consing)
+
+    The result only depends on the circuit, so Alice and Bob get the same circuit when they optimize it separately.
+    """
+    live = compiled.reachable()
+    n_terminals = compiled.n_terminals
+    builder = _Builder(n_terminals)
+
+    # A literal is 2 * wire + negated: the value of a wire of the optimized circuit, possibly negated.
+    # literals[w] is the literal with the value of wire w of the original circuit.
+    literals = [2 * w for w in range(n_terminals)] + [None] * compiled.n_gates
+    for gate in range(compiled.n_gates):
+        wire = n_terminals + gate
+        if not live[wire]:
+            continue
+        code = compiled.gate_types[gate]
+        inputs = [literals[w] for w in compiled.inputs(gate)]
+        if code == BUFFER:
+            literals[wire] = inputs[0]
+        elif code == NOT:
+            literals[wire] = inputs[0] ^ 1
+        elif code in [XOR, XNOR]:
+            a, b = inputs
+            literals[wire] = builder.xor(a, b, code == XNOR)
+        elif code in [AND, OR]:
+            literals[wire] = builder.and_or(code, *inputs)
+        else:
+            raise ValueError(f"Unsupported gate type code: {code}")
+
+    outputs = [builder.wire(literals[w]) for w in compiled.outputs]
+    # An XOR/XNOR gate only read through its complement is left unused
+    return CompiledCircuit(compiled.terminals, builder.gate_types, builder.gate_offsets, builder.gate_inputs,
+                           outputs).prune()
+
+
+def fuse(compiled: CompiledCircuit, k: int = 3) -> CompiledCircuit:
+    """
+    Technology mapping into lookup tables: a gate absorbs the gates that are only read by it (fan-out-free),
+    as long as the absorbed cone has at most k distinct inputs, and becomes a single LutGate with the truth
+    table of the cone. Returns an equivalent circuit with the same terminals and outputs.
+
+    Gates are visited in topological order and absorb their inputs greedily, in input order, so the result
+    only depends on the circuit. A gate that absorbs nothing is kept as it is.
+    XOR and XNOR gates neither absorb nor are absorbed: they are free with Free-XOR garbling,
+    while a lookup table with one more input has twice as many rows.
+    """
+    if not 2 <= k <= MAX_LUT_INPUTS:
+        raise ValueError(f"Lookup tables must have 2 to {MAX_LUT_INPUTS} inputs, got {k}")
+
+    live = compiled.reachable()
+    n_terminals = compiled.n_terminals
+    outputs = set(compiled.outputs)
+    fanout = [0] * compiled.n_wires
+    for gate in range(compiled.n_gates):
+        if live[n_terminals + gate]:
+            for w in compiled.inputs(gate):
+                fanout[w] += 1
+
+    def fusible(w):
+        return w >= n_terminals and fanout[w] == 1 and w not in outputs and \
+            compiled.gate_types[w - n_terminals] not in [XOR, XNOR]
+
+    # leaves[w] are the inputs of the cone of gate wire w, absorbed[w] is set if w is part of its consumer's cone
+    leaves = {}
+    absorbed = bytearray(compiled.n_wires)
+    for gate in range(compiled.n_gates):
+        wire = n_terminals + gate
+        if not live[wire]:
+            continue
+        cone = list(dict.fromkeys(compiled.inputs(gate)))
+        if compiled.gate_types[gate] not in [XOR, XNOR]:
+            for w in compiled.inputs(gate):
+                if fusible(w):
+                    candidate = list(dict.fromkeys([x for x in cone if x != w] + leaves[w]))
+                    if len(candidate) <= k:
+                        cone = candidate
+                        absorbed[w] = 1
+        leaves[wire] = cone
+
+    gate_types = array('B')
+    gate_offsets = array('I', [0])
+    gate_inputs = array('I')
+    gate_tables = {}
+    renumber = list(range(n_terminals)) + [None] * compiled.n_gates
+    for gate in range(compiled.n_gates):
+        wire = n_terminals + gate
+        if not live[wire] or absorbed[wire]:
+            continue
+        inputs = compiled.inputs(gate)
+        if any(absorbed[w] for w in inputs):
+            gate_tables[len(gate_types)] = _cone_table(compiled, wire, leaves[wire])
+            gate_types.append(LUT)
+            inputs = leaves[wire]
+        else:
+            if compiled.gate_types[gate] == LUT:
+                gate_tables[len(gate_types)] = compiled.gate_tables[gate]
+            gate_types.append(compiled.gate_types[gate])
+        gate_inputs.extend(renumber[w] for w in inputs)
+        gate_offsets.append(len(gate_inputs))
+        renumber[wire] = n_terminals + len(gate_types) - 1
+
+    return CompiledCircuit(compiled.terminals, gate_types, gate_offsets, gate_inputs,
+                           [renumber[w] for w in compiled.outputs], gate_tables)
+
+
+def _cone_table(compiled: CompiledCircuit, wire: int, leaves: List[int]) -> int:
+    """
+    Truth table (see LutType) of the cone of gate wire over its leaves, by bit-sliced evaluation of
+    the gates of the cone on all 2^len(leaves) assignments of the leaves.
+    """
+    n_terminals = compiled.n_terminals
+    size = 1 << len(leaves)
+    mask = (1 << size) - 1
+    values = {w: sum(1 << m for m in range(size) if m >> i & 1) for i, w in enumerate(leaves)}
+
+    # The gates of the cone are the gates reachable from wire without crossing a leaf
+    cone = []
+    stack = [wire]
+    while stack:
+        w = stack.pop()
+        if w not in values and w not in cone:
+            cone.append(w)
+            stack.extend(compiled.inputs(w - n_terminals))
+    for w in sorted(cone):
+        gate = w - n_terminals
+        values[w] = compiled.gate_type(gate).evaluate_bits(mask, *[values[x] for x in compiled.inputs(gate)])
+    return values[wire]
+
+
+class _Builder:
+    """
+    Builds the gates of the optimized circuit in topological order, creating each distinct gate once.
+    """
+    def __init__(self, n_terminals: int):
+        self.n_terminals = n_terminals
+        self.gate_types = array('B')
+        self.gate_offsets = array('I', [0])
+        self.gate_inputs = array('I')
+        self.gates = {}  # (type code, input wires) -> wire
+        self.xors = {}   # input wires -> wire of the XOR or XNOR gate of these inputs, whichever was created first
+
+    def gate(self, code: int, inputs: List[int]) -> int:
+        """
+        Returns the wire of the gate with the given type and input wires, creating the gate if needed.
+        """
+        # All binary gate types are symmetric, sorting their inputs makes equal gates equal keys
+        key = (code, *sorted(inputs))
+        if key not in self.gates:
+            self.gate_types.append(code)
+            self.gate_inputs.extend(key[1:])
+            self.gate_offsets.append(len(self.gate_inputs))
+            self.gates[key] = self.n_terminals + len(self.gate_types) - 1
+        return self.gates[key]
+
+    def wire(self, literal: int) -> int:
+        """
+        Returns a wire carrying the value of the literal, creating an XNOR or NOT gate for a negated literal.
+        """
+        wire = literal >> 1
+        if not literal & 1:
+            return wire
+        gate = wire - self.n_terminals
+        if gate >= 0 and self.gate_types[gate] in [XOR, XNOR]:
+            complement = XNOR if self.gate_types[gate] == XOR else XOR
+            return self.gate(complement, self.gate_inputs[self.gate_offsets[gate]:self.gate_offsets[gate + 1]])
+        return self.gate(NOT, [wire])
+
+    def xor(self, a: int, b: int, negated: bool) -> int:
+        """
+        Returns the literal of the XOR of the literals a and b, negated if negated is set (XNOR).
+        XOR and XNOR of the same inputs share one gate, the negations of the inputs move to the output.
+        """
+        negated = (a ^ b) & 1 ^ negated
+        key = tuple(sorted([a >> 1, b >> 1]))
+        if key not in self.xors:
+            self.xors[key] = self.gate(XNOR if negated else XOR, list(key))
+        wire = self.xors[key]
+        return 2 * wire | negated ^ (self.gate_types[wire - self.n_terminals] == XNOR)
+
+    def and_or(self, code: int, a: int, b: int) -> int:
+        """
+        Returns the literal of the AND/OR (code) of the literals a and b.
+        """
+        if a == b:
+            return a
+        return 2 * self.gate(code, [self.wire(a), self.wire(b)])
@@ -1,10 +1,19 @@
-import pickle
+import hashlib
+import mmap
+import os
+import struct
 import sys
+import threading
+from array import array
 from typing import List
 import datetime
+from itertools import chain
 
+from circuits.bristol import is_bristol, parse_bristol
 from circuits.circuit import Circuit
+from circuits.compiled import CompiledCircuit
 from circuits.elements import Terminal
+from circuits.optimizer import optimize as optimize_circuit, fuse
 
 def log(message):
     script = sys.argv[0]
@@ -25,27 +34,21 @@ def next_line(file):
         if line and not line.startswith('#'):
             return line
 
-def read_circuit_description(file):
-    description = []
-    while True:
-        line = file.readline()
-        if not line:
-            raise EOFError("End of file reached while reading circuit description")
-        description.append(line)
+# Compiled circuit cache file (see load_circuit_from_file): the number of Alice's and Bob's terminals,
+# their indices in the terminals of the circuit as 32-bit integers, then the compiled circuit
+# (see CompiledCircuit.to_bytes), all in native byte order
+COMPILED_PARTIES = struct.Struct('=II')
+COMPILED_SUFFIX = '.compiled'
 
-        if line.startswith('output'):
-            break
-    return '\n'.join(description)
-
-def load_circuit_from_file(file_path):
+def load_circuit_from_file(file_path, optimize=True, lut=None, verbose=False, cache_dir=None, digest=None):
     """
     Expects a file with the following format:
         - The file starts with the circuit description.
             - Each line represents a gate or terminal.
               - A terminal is represented in the following format: term identifier
               - A gate is represented in the following format: (gate_type input1 input2 ... inputN identifier)
-        - The circuit representation ends with a line in the format: output identifier
-              - identifier is the identifier of the output terminal or gate.
+        - The circuit representation ends with a line in the format: output identifier1 identifier2 ... identifierK
+              - the identifiers are the identifiers of the output terminals or gates, in order.
         - Then alices terminals are listed in the format: a1, a2, ..., an
         - Then bobs terminals are listed in the format: b1, b2, ..., bm
         - All subsequent lines are ignored.
@@ -62,21 +65,102 @@ def load_circuit_from_file(file_path):
             output g3
             a0, a1
             b0, b1
+
+    With optimize, the circuit goes through circuits.optimizer.optimize, which only depends on the circuit,
+    so Alice and Bob get the same circuit from the same file. With lut=k, its gates are then fused into
+    lookup tables of up to k inputs (see circuits.optimizer.fuse). With verbose, the gate counts before and after
+    are logged.
+
+    Files in Bristol Fashion, recognized by their first line (see circuits.bristol), are also accepted.
+    Their terminals are named in<i>_<j> for bit j of input value i, starting from 0. Alice holds the first
+    input value and Bob all the others, and the outputs are the bits of all output values, in order.
+
+    The circuit description is parsed one line at a time (see CompiledCircuit.parse).
+    With cache_dir, the result is also stored in a binary file of that directory, named after the hash of
+    the circuit file (digest if given, see circuit_hash) and the options. Later loads of a file with the same
+    contents map that file into memory instead of parsing and optimizing the circuit again.
+    An entry that fails to decode (see CompiledCircuit.from_buffer) is rebuilt.
     """
-    with open(file_path, 'r') as f:
-        description = read_circuit_description(f)
-        circuit = Circuit.deserialize(description)
-        terminals = circuit.terminals
+    if cache_dir is not None:
+        digest = digest if digest is not None else circuit_hash(file_path)
+        cache_path = os.path.join(cache_dir, f"{digest.hex()}-{int(optimize)}-{lut or 0}{COMPILED_SUFFIX}")
+        if os.path.exists(cache_path):
+            if verbose:
+                log(f"Loading compiled circuit from {cache_path}")
+            try:
+                return read_compiled_circuit(cache_path)
+            except ValueError as e:
+                # Truncated or corrupted entry: treated as a miss, rebuilt and overwritten below
+                log(f"Ignoring compiled circuit {cache_path}: {e}")
 
-        name2terminal = {t.name: t for t in terminals}
-        alice_terminals = [name2terminal[name] for name in next_line(f).split(' ')]
-        bob_terminals = [name2terminal[name] for name in next_line(f).split(' ')]
+    with open(file_path, 'r') as f:
+        first = next_line(f) or ''
+        lines = chain([first], iter(f.readline, ''))
+        if is_bristol(first):
+            compiled, inputs = parse_bristol(lines)
+            circuit = Circuit.from_compiled(compiled)
+            terminals = circuit.terminals
+            alice_terminals = inputs[0] if inputs else []
+            bob_terminals = [t for value in inputs[1:] for t in value]
+        else:
+            circuit = Circuit.from_compiled(CompiledCircuit.parse(lines))
+            terminals = circuit.terminals
+            name2terminal = {t.name: t for t in terminals}
+            alice_terminals = [name2terminal[name] for name in next_line(f).split(' ')]
+            bob_terminals = [name2terminal[name] for name in next_line(f).split(' ')]
 
         all_terminals = set(alice_terminals + bob_terminals)
         if len(all_terminals) != len(terminals):
             raise ValueError("Each terminal should be assigned to either Alice or Bob")
+
+    if optimize:
+        compiled = optimize_circuit(circuit.compiled)
+        if verbose:
+            log(f"Optimized circuit from {circuit.compiled.n_gates} to {compiled.n_gates} gates")
+        circuit = Circuit.from_compiled(compiled)
+    if lut is not None:
+        compiled = fuse(circuit.compiled, lut)
+        if verbose:
+            log(f"Fused circuit from {circuit.compiled.n_gates} gates to {compiled.n_gates} lookup tables and gates")
+        circuit = Circuit.from_compiled(compiled)
+
+    if cache_dir is not None:
+        write_compiled_circuit(cache_path, circuit, alice_terminals, bob_terminals)
     return circuit, alice_terminals, bob_terminals
 
+def write_compiled_circuit(path, circuit, alice_terminals, bob_terminals):
+    index = {t: i for i, t in enumerate(circuit.compiled.terminals)}
+    indices = array('I', [index[t] for t in alice_terminals + bob_terminals])
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # Written under a unique name and renamed, so readers never see a partial file
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(COMPILED_PARTIES.pack(len(alice_terminals), len(bob_terminals)))
+        f.write(indices.tobytes())
+        f.write(circuit.compiled.to_bytes())
+    os.replace(tmp, path)
+
+def read_compiled_circuit(path):
+    """
+    Returns (circuit, alice_terminals, bob_terminals) from a file written by write_compiled_circuit.
+    The file is memory-mapped, the arrays of the circuit are read from it as they are used.
+    """
+    with open(path, 'rb') as f:
+        view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    if len(view) < COMPILED_PARTIES.size:
+        raise ValueError(f"Truncated compiled circuit {path}")
+    n_alice, n_bob = COMPILED_PARTIES.unpack_from(view, 0)
+    end = COMPILED_PARTIES.size + 4 * (n_alice + n_bob)
+    if end > len(view):
+        raise ValueError(f"Truncated compiled circuit {path}")
+    compiled = CompiledCircuit.from_buffer(view[end:])
+    indices = view[COMPILED_PARTIES.size:end].cast('I')
+    if n_alice + n_bob != compiled.n_terminals or sorted(indices) != list(range(compiled.n_terminals)):
+        raise ValueError("Each terminal should be assigned to either Alice or Bob")
+    terminals = compiled.terminals
+    return Circuit.from_compiled(compiled), [terminals[i] for i in indices[:n_alice]], \
+        [terminals[i] for i in indices[n_alice:]]
+
 def load_assignment_from_file(file_path, terminals: List[Terminal]):
     """
     Expects a file with the following format:
@@ -109,18 +193,168 @@ def load_assignment_from_file(file_path, terminals: List[Terminal]):
 
     return assignments
 
-def read_object(sock, buffer_size=65000, verbose=False):
-    data = sock.recv(buffer_size)
-    obj = pickle.loads(data)
+def load_batch_from_file(file_path, terminals: List[Terminal]):
+    """
+    Expects a file with the following format:
+        - The first line lists the names of all the terminals, separated by spaces.
+        - Every following line is one assignment: the values (0 or 1) of the terminals, in the same order.
+        - Empty lines or lines starting with '#' are ignored.
+        Example:
+            a0 a1
+            1 0
+            0 0
+    Returns the list of assignments, see load_assignment_from_file.
+    """
+    name2terminal = {t.name: t for t in terminals}
+    assignments = []
+    with open(file_path, 'r') as f:
+        header = next_line(f)
+        names = header.split() if header else []
+        for name in names:
+            if name not in name2terminal:
+                raise ValueError(f"Terminal {name} not found in circuit")
+        if len(set(names)) != len(names) or len(names) != len(name2terminal):
+            raise ValueError("The header of a batch must list every terminal once")
+        columns = [name2terminal[name] for name in names]
 
+        while line := next_line(f):
+            tokens = line.split()
+            if len(tokens) != len(columns) or any(token not in ['0', '1'] for token in tokens):
+                raise ValueError(f"Invalid assignment in batch: {line}")
+            assignments.append({t: token == '1' for t, token in zip(columns, tokens)})
+    return assignments
+
+def circuit_hash(file_path):
+    """
+    SHA256 hash of the contents of a circuit file. Alice and Bob compare it to check that they use the same circuit.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while block := f.read(1 << 20):
+            digest.update(block)
+    return digest.digest()
+
+class CircuitCache:
+    """
+    Parsed circuit files, by the hash of their contents.
+    load(file_path) only hashes the file again if its size or modification time changed,
+    and only parses it if no file with the same contents was parsed before.
+    Safe to use from multiple threads.
+    With cache_dir, parsed circuits are also kept on disk (see load_circuit_from_file).
+    """
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.hashes = {}    # file path -> ((modification time, size), hash)
+        self.circuits = {}  # hash -> (circuit, alice_terminals, bob_terminals)
+        self.lock = threading.Lock()
+
+    def load(self, file_path, verbose=False):
+        """
+        Returns (hash, circuit, alice_terminals, bob_terminals), see load_circuit_from_file.
+        """
+        stat = os.stat(file_path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if file_path not in self.hashes or self.hashes[file_path][0] != key:
+                self.hashes[file_path] = (key, circuit_hash(file_path))
+            digest = self.hashes[file_path][1]
+            if digest not in self.circuits:
+                self.circuits[digest] = load_circuit_from_file(file_path, verbose=verbose, cache_dir=self.cache_dir,
+                                                               digest=digest)
+            return (digest, *self.circuits[digest])
+
+# Wire protocol: every message is a frame consisting of a header followed by the payload.
+# The header holds the protocol version, the message type and the length of the payload.
+# Payloads are binary encodings (see GarbledCircuit.serialize and ObliviousTransfer.serialize_keys),
+# nothing received from the other party is unpickled.
+PROTOCOL_VERSION = 2
+HEADER = struct.Struct('!BBQ')
+
+# Message types
+MESSAGE_OT_KEYS = 1         # OT public keys (of Alice for the base OTs of OT extension)
+MESSAGE_OT_CIPHERTEXTS = 2  # OT ciphertexts (of Bob for the base OTs of OT extension)
+MESSAGE_GARBLED_CIRCUIT = 3 # a complete garbled circuit
+MESSAGE_GARBLED_HEADER = 4  # first message of a streamed garbled circuit
+MESSAGE_GARBLED_CHUNK = 5   # a GarbledChunk of a streamed garbled circuit
+MESSAGE_GARBLED_END = 6     # output of a streamed garbled circuit, ends the stream
+MESSAGE_OT_EXTENSION_MATRIX = 7       # Bob's matrix u of OT extension
+MESSAGE_OT_EXTENSION_CIPHERTEXTS = 8  # Alice's ciphertexts of OT extension
+MESSAGE_OT_POOL_CORRECTIONS = 9       # Bob's pool segments and corrections for precomputed OTs
+MESSAGE_OT_POOL_CIPHERTEXTS = 10      # Alice's ciphertexts for precomputed OTs
+MESSAGE_OT_POOL_BATCH = 11            # id and size of a batch of random OTs for the pools (ot_pool.py)
+MESSAGE_HELLO = 12                    # first message of a session, the hash of Alice's circuit file
+MESSAGE_BATCH_SIZE = 13               # number of evaluations of a batch session (BATCH_SIZE)
+MESSAGE_GARBLED_INPUTS = 14           # passwords of Alice's assignment, precedes a pre-garbled circuit
+
+BATCH_SIZE = struct.Struct('!Q')
+
+# Largest payload accepted by default
+MAX_MESSAGE_SIZE = 1 << 30
+# Initial size of the receive buffer of read_exactly, which then doubles as data arrives
+READ_CHUNK_SIZE = 1 << 20
+
+def send_message(sock, message_type, payload, verbose=False):
+    """
+    Sends a frame with the given message type and payload (bytes-like).
+    """
     if verbose:
-        script = sys.argv[0]
-        log(f"Received object: {obj}")
-    return obj
+        log(f"Sending message of type {message_type} ({len(payload)} bytes)")
+    header = HEADER.pack(PROTOCOL_VERSION, message_type, len(payload))
+    if len(payload) < 1 << 16:
+        sock.sendall(header + payload)
+    else:
+        sock.sendall(header)
+        sock.sendall(payload)
 
-def send_object(sock, obj, verbose=False):
+def read_message(sock, max_size=MAX_MESSAGE_SIZE, verbose=False):
+    """
+    Reads a frame and returns (message_type, payload).
+    The payload is read into a buffer that grows with the data received (see read_exactly), so a header
+    announcing a large payload does not allocate it before the payload arrives.
+    Raises ValueError if the frame has an unsupported version or is larger than max_size (None for no limit).
+    """
+    version, message_type, length = HEADER.unpack(read_exactly(sock, HEADER.size))
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version: {version}")
+    if max_size is not None and length > max_size:
+        raise ValueError(f"Message of {length} bytes exceeds the limit of {max_size} bytes")
     if verbose:
-        script = sys.argv[0]
-        log(f"Sending object: {obj}")
-    data = pickle.dumps(obj)
-    sock.sendall(data)
\ No newline at end of file
+        log(f"Received message of type {message_type} ({length} bytes)")
+    return message_type, read_exactly(sock, length)
+
+def read_expected_message(sock, message_type, max_size=MAX_MESSAGE_SIZE, verbose=False):
+    """
+    Reads a frame of the given message type and returns its payload.
+    """
+    received_type, payload = read_message(sock, max_size, verbose)
+    if received_type != message_type:
+        raise ValueError(f"Unexpected message type: {received_type}")
+    return payload
+
+def read_exactly(sock, n):
+    """
+    Reads exactly n bytes from the socket, looping until all of them have arrived.
+    The buffer starts at READ_CHUNK_SIZE bytes and doubles when it is full, so it is never more than
+    twice the size of the data received.
+    """
+    buffer = bytearray(min(n, READ_CHUNK_SIZE))
+    received = 0
+    while received < n:
+        if received == len(buffer):
+            buffer.extend(bytes(min(len(buffer), n - len(buffer))))
+        with memoryview(buffer) as view:
+            count = sock.recv_into(view[received:])
+        if count == 0:
+            raise EOFError(f"Connection closed after {received} of {n} bytes")
+        received += count
+    return buffer
+
+def get_option(name, default=None):
+    """
+    Returns the value of a command line option given as --name=value, or default if it is not given.
+    """
+    prefix = f'--{name}='
+    for arg in sys.argv[1:]:
+        if arg.startswith(prefix):
+            return arg[len(prefix):]
+    return default
@@ -29,8 +29,8 @@ alice_assignment = {
 }
 
 alice_passwords = {
-    b0: [GarbledCircuit.random_password(), GarbledCircuit.random_password()],
-    b1: [GarbledCircuit.random_password(), GarbledCircuit.random_password()],
+    b0: GarbledCircuit.random_password_pair(),
+    b1: GarbledCircuit.random_password_pair(),
 }
 
 
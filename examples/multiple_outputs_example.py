@@ -0,0 +1,40 @@
+import sys
+from itertools import product
+from circuits.circuit import Circuit
+from circuits.elements import Terminal, AndGate, XorGate
+from garbled_circuits.garbled_circuit import GarbledCircuit
+from garbled_circuits.garbled_gate import MODES, CLASSIC, HALF_GATES
+
+### Outputs: a & b, a terminal (b), and a gate also read by another gate (a ^ b)
+
+a = Terminal("a")
+b = Terminal("b")
+c = Terminal("c")
+
+x = XorGate(a, b)
+g = AndGate(x, c)
+
+circuit = Circuit([a, b, c], [g, b, x])
+
+errors = 0
+for mode in MODES:
+    for alice_a, trial in product([False, True], range(20)):
+        alice_assignment = {a: alice_a}
+        if mode == CLASSIC and trial % 2:
+            # Independent passwords, whose select bits may be equal, are valid in classic mode
+            alice_passwords = {t: [GarbledCircuit.random_password(), GarbledCircuit.random_password()] for t in [b, c]}
+        else:
+            offset = GarbledCircuit.random_offset() if mode == HALF_GATES else None
+            alice_passwords = {t: GarbledCircuit.random_password_pair(offset) for t in [b, c]}
+
+        garbled_circuit = GarbledCircuit.garble(circuit, alice_assignment, alice_passwords, mode=mode)
+        for values in product([False, True], repeat=2):
+            bob_assignment = dict(zip([b, c], values))
+            expected = circuit.simplify({**alice_assignment, **bob_assignment})
+            val = garbled_circuit.evaluate({t: alice_passwords[t][v] for t, v in bob_assignment.items()})
+            if expected != val:
+                errors += 1
+                print(f"Error: {mode}, a={alice_a}, b, c={values}: expected {expected}, got {val}")
+
+print(f"{errors} errors")
+sys.exit(1 if errors else 0)
@@ -0,0 +1,30 @@
+"""
+Writes a circuit file in Bristol Fashion (see circuits.bristol), e.g. to compare with other garbled circuit
+implementations on the same circuit. Alice's terminals form the first input value and Bob's the second,
+the outputs form a single output value.
+
+Usage:
+    python export_bristol.py <circuit_file> <bristol_file> [--no-optimize]
+
+The circuit is optimized like in alice.py and bob.py unless --no-optimize is given.
+"""
+
+import sys
+
+from circuits.bristol import serialize_bristol
+from common import log, load_circuit_from_file
+
+def usage():
+    log(__doc__)
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if len(args) != 2:
+        usage()
+    circuit, alice_terminals, bob_terminals = load_circuit_from_file(args[0], optimize='--no-optimize' not in sys.argv)
+    lines = list(serialize_bristol(circuit.compiled, [alice_terminals, bob_terminals]))
+    with open(args[1], 'w') as f:
+        f.writelines(line + '\n' for line in lines)
+    log(f"Wrote {args[1]}")
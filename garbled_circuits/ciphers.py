@@ -0,0 +1,104 @@
+from abc import ABC, abstractmethod
+from typing import List, Tuple
+
+from Crypto.Cipher import AES, Salsa20
+from Crypto.Hash import SHA256
+
+
+class CipherBackend(ABC):
+    """
+    Derives the pads used to encrypt the rows of garbled truth tables (see GarbledGate).
+
+    pad(passwords, tweak, n) returns n pseudorandom bytes determined by the passwords and the tweak.
+    The garbler encrypts a row by XORing it with the pad of the row's input passwords,
+    the evaluator recomputes the same pad to decrypt it.
+    pads(requests) computes the pads for a list of (passwords, tweak, n) at once.
+
+    Backends are used by the point-and-permute (the default, see garbled_gate.DEFAULT_MODE), grr3 and
+    half-gates modes. Classic mode keeps the original SHA256 keyed tables with Salsa20 and random nonces
+    (see GarbledGate._garble_classic) and ignores the backend.
+    """
+    name = None
+
+    @abstractmethod
+    def pad(self, passwords: List[bytes], tweak: int, n: int) -> bytes:
+        pass
+
+    def pads(self, requests: List[Tuple[List[bytes], int, int]]) -> List[bytes]:
+        return [self.pad(passwords, tweak, n) for passwords, tweak, n in requests]
+
+
+class Sha256Salsa20(CipherBackend):
+    """
+    SHA256 and Salsa20 as in classic mode, adapted to the tweaked pads of the other modes: a Salsa20 key
+    is derived by hashing the passwords and the tweak with SHA256, and the pad is its keystream.
+    The key is unique per row, so a fixed nonce is used.
+    Needs a new hash and a new cipher object for every row.
+    """
+    name = 'sha256-salsa20'
+
+    def pad(self, passwords: List[bytes], tweak: int, n: int) -> bytes:
+        key = SHA256.new(data=b''.join(passwords) + tweak.to_bytes(8, 'big')).digest()
+        return Salsa20.new(key, nonce=bytes(8)).encrypt(bytes(n))
+
+
+class FixedKeyAes(CipherBackend):
+    """
+    Fixed-key AES-128 hash (Bellare, Hoang, Keelveedhi, Rogaway).
+    The passwords are compressed into one 128 bit block x by doubling in GF(2^128), x = 2x ^ block for each
+    16 byte block. The pad consists of the blocks pi(k_j) ^ k_j with k_j = x ^ (tweak || j), where pi is
+    AES-128 under a fixed public key. The AES key schedule is computed once, and all blocks
+    requested with pads are computed with a single AES-ECB call.
+    """
+    name = 'aes'
+
+    KEY = SHA256.new(data=b'garbled circuits fixed key').digest()[:16]
+    MASK = (1 << 128) - 1
+
+    def __init__(self):
+        self.cipher = AES.new(self.KEY, AES.MODE_ECB)
+
+    def pad(self, passwords: List[bytes], tweak: int, n: int) -> bytes:
+        return self.pads([(passwords, tweak, n)])[0]
+
+    def pads(self, requests: List[Tuple[List[bytes], int, int]]) -> List[bytes]:
+        keys = []
+        for passwords, tweak, n in requests:
+            data = b''.join(passwords)
+            x = 0
+            for i in range(0, len(data), 16):
+                x = self._double(x) ^ int.from_bytes(data[i:i + 16], 'big')
+            keys.extend((x ^ (tweak << 64 | j)).to_bytes(16, 'big') for j in range((n + 15) // 16))
+
+        keys = b''.join(keys)
+        blocks = (int.from_bytes(self.cipher.encrypt(keys), 'big') ^ int.from_bytes(keys, 'big')).to_bytes(len(keys), 'big')
+
+        pads = []
+        start = 0
+        for _, _, n in requests:
+            pads.append(blocks[start:start + n])
+            start += (n + 15) // 16 * 16
+        return pads
+
+    @staticmethod
+    def _double(x: int) -> int:
+        """
+        Multiplication by 2 in GF(2^128) with the polynomial x^128 + x^7 + x^2 + x + 1
+        """
+        x <<= 1
+        if x >> 128:
+            x = (x & FixedKeyAes.MASK) ^ 0x87
+        return x
+
+
+CIPHERS = {backend.name: backend for backend in [FixedKeyAes(), Sha256Salsa20()]}
+DEFAULT_CIPHER = FixedKeyAes.name
+
+
+def get_cipher(name: str) -> CipherBackend:
+    """
+    Returns the cipher backend with the given name, one of CIPHERS.
+    """
+    if name not in CIPHERS:
+        raise ValueError(f"Unsupported cipher backend: {name}")
+    return CIPHERS[name]
@@ -1,10 +1,43 @@
 from __future__ import annotations
+import multiprocessing
 import os
-from typing import Tuple, List, Dict
+import struct
+import sys
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Iterable, Iterator, Tuple
 
 from circuits.circuit import Circuit
-from circuits.elements import Terminal
-from garbled_circuits.garbled_gate import GarbledGate
+from circuits.compiled import CompiledCircuit
+from circuits.elements import Terminal, BufferGate
+from garbled_circuits.ciphers import get_cipher, CIPHERS, DEFAULT_CIPHER
+from garbled_circuits.garbled_gate import GarbledGate, CLASSIC, GRR3, HALF_GATES, MODES, DEFAULT_MODE, PASSWORD_LENGTH
+
+# Number of gates per chunk yielded by GarbledCircuit.garble_stream
+DEFAULT_CHUNK_SIZE = 1024
+
+# Parallel garbling and evaluation: levels with fewer gates are processed in the calling process
+PARALLEL_THRESHOLD = 256
+
+# Process pools for parallel garbling and evaluation, by number of workers
+_executors = {}
+_executors_lock = threading.Lock()
+
+# Binary encoding (see GarbledCircuit.serialize and GarbledChunk.serialize)
+FORMAT_VERSION = 1
+CIPHER_NAMES = list(CIPHERS)
+CIRCUIT_HEADER = struct.Struct('!BBBI')  # version, mode, cipher, number of terminals
+NAME_LENGTH = struct.Struct('!H')
+OUTPUT = struct.Struct('!BQ')            # kind (see OUTPUT_*), value (see GarbledCircuit.serialize_output)
+CHUNK_HEADER = struct.Struct('!BII')     # version, number of gates, number of released wires
+PASSWORDS_HEADER = struct.Struct('!BI')  # version, number of terminals
+OUTPUT_NONE, OUTPUT_FALSE, OUTPUT_TRUE, OUTPUT_WIRE, OUTPUT_SELECT, OUTPUT_LIST = range(6)
+# Layouts of garbled truth tables
+LAYOUT_FREE, LAYOUT_ROWS, LAYOUT_CLASSIC = range(3)
+CLASSIC_KEY_LENGTH = 32
+CLASSIC_NONCE_LENGTH = 8
 
 
 class GarbledCircuit:
@@ -23,79 +56,749 @@ class GarbledCircuit:
         GarbledCircuit.garble(circuit, assignment, input_passwords) constructs the garbled circuit.
         garbled_circuit.evaluate(passwords) evaluates the garbled circuit with the given passwords.
 
-        passwords for the terminals should be generated using the GarbledCircuit.random_password() function.
+        passwords for the terminals should be generated using the GarbledCircuit.random_password_pair() function.
+
+        Free-XOR: if all input password pairs are of the form [p, p ^ offset] for a single global offset
+        (see GarbledCircuit.random_password_pair), every password pair in the circuit is generated with that offset.
+        XOR, XNOR, NOT and BUFFER gates then need no truth table, the evaluator XORs the input passwords.
+
+        The garbling mode (see garbled_gate.MODES) decides the layout of the garbled truth tables.
+        The cipher backend (see garbled_circuits.ciphers) derives the pads that encrypt the rows.
+        Both are stored in the garbled circuit, so the evaluator does not need to be told about them.
+        All modes but classic require the two passwords of every input to have different select bits,
+        which is the case for passwords generated with GarbledCircuit.random_password_pair.
+        The half-gates mode also requires Free-XOR input passwords.
+
+        Like CompiledCircuit, the garbled circuit is flat:
+            - wire i < len(terminals) carries the password of terminals[i]
+            - wire len(terminals) + j carries the output of gates[j]
+            - gates are in topological order and refer to their inputs by wire id
+            - output tells how to decode an output of the circuit:
+                - a boolean if the output only depends on the assignment
+                - a wire id if the wire is read by no gate: its gate is garbled with the boolean values
+                  of the output as passwords. A garbled terminal gets an extra identity gate garbled this way.
+                - (wire id, d) otherwise: the value is the select bit of the password of the wire XOR d.
+                  The passwords of gate outputs always have different select bits.
+              A circuit with several outputs has a list of them, in order, and evaluates to a list of booleans.
     """
-    def __init__(self, terminals: List[Terminal], output: GarbledGate):
+    def __init__(self, terminals: List[Terminal], gates: List[GarbledGate], output, mode: str = DEFAULT_MODE,
+                 cipher: str = DEFAULT_CIPHER):
         self.terminals = terminals
+        self.gates = gates
         self.output = output
+        self.mode = mode
+        self.cipher = cipher
 
     @staticmethod
-    def garble(circuit: Circuit,
+    def garble(circuit: Circuit | CompiledCircuit,
             assignments: Dict[Terminal, bool],
-            input_passwords: Dict[Terminal, List[bytes]]
+            input_passwords: Dict[Terminal, List[bytes]],
+            mode: str = DEFAULT_MODE,
+            cipher: str = DEFAULT_CIPHER,
+            workers: int | None = None
         ) -> GarbledCircuit:
         """
         Contruct the garbled circuit with a circuit object and partial assignments.
         assignments is a dictionary of terminal -> boolean value.
         input_passwords is a dictionary of terminal -> list of two passwords.
+        mode is the garbling mode, one of garbled_gate.MODES, point-and-permute by default (see DEFAULT_MODE).
+        cipher is the name of the cipher backend, one of ciphers.CIPHERS. Classic mode, the original construction,
+        does not use it.
+        workers is the number of processes garbling in parallel (see garble_stream), None garbles serially.
+
+        Gates are garbled in topological order. Each gate in the cone of influence of the outputs
+        is garbled exactly once, the passwords of its output are shared by all of its consumers.
+
+        The assignment is folded through the circuit first: a gate whose inputs are all fixed by the assignment
+        (directly or through other folded gates) is evaluated in the clear and produces no garbled gate.
+        Which gates are folded only depends on which terminals are assigned, never on their values:
+        a gate with some garbled inputs is always garbled, with a truth table reduced on its fixed inputs,
+        even when the fixed values alone decide its output (e.g. AND with a False input). Dropping such
+        a gate would change the shape of the garbled circuit with the assignment and reveal it to the evaluator.
         """
+        return GarbledCircuit.from_stream(GarbledCircuit.garble_stream(circuit, assignments, input_passwords, mode,
+                                                                       cipher, None, workers))
+
+    @staticmethod
+    def garble_stream(circuit: Circuit | CompiledCircuit,
+            assignments: Dict[Terminal, bool],
+            input_passwords: Dict[Terminal, List[bytes]],
+            mode: str = DEFAULT_MODE,
+            cipher: str = DEFAULT_CIPHER,
+            chunk_size: int = DEFAULT_CHUNK_SIZE,
+            workers: int | None = None
+        ) -> Iterator:
+        """
+        Same as garble, but garbles the circuit lazily and yields it in pieces:
+            - first, a GarbledCircuit without gates and output (the terminals, the mode and the cipher)
+            - then GarbledChunk objects with up to chunk_size consecutive gates each
+            - finally, the output (see GarbledCircuit.output), a list for a circuit with several outputs
+
+        Every chunk lists the wires that are not read by any later gate, so the evaluator can drop them
+        (see StreamingEvaluator). The passwords of a wire are dropped by the garbler after its last use as well,
+        so the memory used on both sides does not grow with the size of the circuit.
+
+        With workers > 1, the gates are garbled level by level before the first chunk is yielded:
+        the gates of a level only read wires of lower levels, so they are split across a pool of worker processes.
+        The garbled circuit has the same gates, in the same order and with the same tweaks, as the serial one.
+        """
+
+        if mode not in MODES:
+            raise ValueError(f"Unsupported garbling mode: {mode}")
+        if mode != CLASSIC:
+            for t, (p0, p1) in input_passwords.items():
+                if GarbledGate.select_bit(p0) == GarbledGate.select_bit(p1):
+                    raise ValueError(f"Passwords of terminal {t} have the same select bit")
+
+        backend = get_cipher(cipher)
+        compiled = circuit if isinstance(circuit, CompiledCircuit) else circuit.compiled
+        offset = GarbledCircuit._free_xor_offset(input_passwords)
+        if mode == HALF_GATES and offset is None:
+            raise ValueError("half-gates mode requires input passwords sharing a Free-XOR offset")
+        live = compiled.reachable()
+        terminals = [t for t in compiled.terminals if t not in assignments]
+        terminal_wires = {t: i for i, t in enumerate(terminals)}
+
+        # values[w] is the boolean value of wire w if it is fixed by the assignment, otherwise its garbled wire id.
+        # passwords[w] are the two passwords of wire w, or None if it is fixed.
+        values = []
+        passwords = []
+        for wire, t in enumerate(compiled.terminals):
+            if t in assignments:
+                values.append(assignments[t])
+                passwords.append(None)
+            elif t in input_passwords:
+                values.append(terminal_wires[t])
+                passwords.append(input_passwords[t])
+            elif live[wire]:
+                raise ValueError(f"Terminal {t} not found in input_passwords or assignments")
+            else:
+                values.append(None)
+                passwords.append(None)
+
+        n_terminals = compiled.n_terminals
+        last_use = [-1] * compiled.n_wires
+        for gate in range(compiled.n_gates):
+            if live[n_terminals + gate]:
+                for w in compiled.inputs(gate):
+                    last_use[w] = gate
+        # Output gates read by no other gate encrypt the boolean value of the output directly
+        outputs = set(compiled.outputs)
+        roots = {w for w in outputs if w >= n_terminals and last_use[w] == -1}
+
+        yield GarbledCircuit(terminals, [], None, mode, cipher)
+
+        precomputed = None
+        if workers is not None and workers > 1:
+            precomputed = GarbledCircuit._garble_levels(compiled, live, values, passwords, roots, mode, cipher,
+                                                        offset, workers)
+
+        gates = []
+        release = []
+        n_garbled = len(terminals)
+        for gate in range(compiled.n_gates):
+            wire = n_terminals + gate
+            if not live[wire]:
+                values.append(None)
+                passwords.append(None)
+                continue
+
+            input_wires = compiled.inputs(gate)
+            inputs = [values[w] for w in input_wires]
+            pin = [passwords[w] for w in input_wires]
+
+            gate_type = compiled.gate_type(gate)
+            if all(type(x) == bool for x in inputs):
+                # Fixed by the assignment: folded (see garble)
+                values.append(gate_type.simplify(*inputs))
+                passwords.append(None)
+                continue
+
+            is_root = wire in roots
+            is_free = offset is not None and _is_linear(gate_type)
+
+            if precomputed is not None:
+                garbled_gate, output_passwords = precomputed.pop(gate)
+            else:
+                garbled_gate, output_passwords = _garble_gate(gate_type, inputs, pin, mode, n_garbled, offset, backend,
+                                                              is_free, is_root)
+            gates.append(garbled_gate)
+
+            values.append(n_garbled)
+            passwords.append(output_passwords)
+            n_garbled += 1
+
+            for w in input_wires:
+                if last_use[w] == gate and w not in outputs and passwords[w] is not None:
+                    passwords[w] = None
+                    release.append(values[w])
+
+            if chunk_size is not None and len(gates) >= chunk_size:
+                yield GarbledChunk(gates, release)
+                gates, release = [], []
+
+        # Garbled terminals among the outputs get an identity gate encrypting their boolean value, like the roots,
+        # as their input passwords may have the same select bit (e.g. in classic mode)
+        identities = {}
+        for w in compiled.outputs:
+            if w < n_terminals and type(values[w]) == int and w not in identities:
+                garbled_gate, _ = _garble_gate(BufferGate, [values[w]], [passwords[w]], mode, n_garbled, offset,
+                                               backend, False, True)
+                gates.append(garbled_gate)
+                identities[w] = n_garbled
+                n_garbled += 1
+
+        if gates or release:
+            yield GarbledChunk(gates, release)
 
-        terminals = list(set(circuit.terminals) - set(assignments.keys()))
-        output = GarbledCircuit._dfs_construct(circuit.output, input_passwords, assignments, is_root=True)[0]
-        return GarbledCircuit(terminals, output)
+        output = []
+        for w in compiled.outputs:
+            if type(values[w]) == bool or w in roots:
+                output.append(values[w])
+            elif w in identities:
+                output.append(identities[w])
+            else:
+                output.append((values[w], GarbledGate.select_bit(passwords[w][0])))
+        yield output[0] if len(output) == 1 else output
 
     @staticmethod
-    def random_password() -> bytes:
+    def _garble_levels(compiled: CompiledCircuit, live: bytearray, values: List, passwords: List, roots: set,
+                       mode: str, cipher: str, offset: bytes | None,
+                       workers: int) -> Dict[int, Tuple[GarbledGate, List[bytes]]]:
         """
-        Generate a random password. This function should be used to generate the passwords for the terminals.
+        Garbles the live gates level by level, for garble_stream. values and passwords are those of the terminals.
+        Returns gate -> (garbled gate, output passwords). Gates fixed by the assignment are folded, as in
+        garble_stream, and have no entry.
+        Gates with a truth table are garbled on the process pool if their level has at least PARALLEL_THRESHOLD
+        of them, free gates are always garbled here. Garbled wire ids are assigned in topological order,
+        as in garble_stream.
         """
-        return os.urandom(32)
+        n_terminals = compiled.n_terminals
+        values = values + [None] * compiled.n_gates
+        passwords = passwords + [None] * compiled.n_gates
+        n_garbled = sum(type(v) == int for v in values)
+
+        levels = []
+        level = [0] * compiled.n_wires
+        for gate in range(compiled.n_gates):
+            wire = n_terminals + gate
+            if not live[wire]:
+                continue
+            input_wires = compiled.inputs(gate)
+            if all(type(values[w]) == bool for w in input_wires):
+                values[wire] = compiled.gate_type(gate).simplify(*[values[w] for w in input_wires])
+                continue
+            level[wire] = 1 + max((level[w] for w in compiled.inputs(gate)), default=0)
+            if level[wire] > len(levels):
+                levels.append([])
+            levels[level[wire] - 1].append(gate)
+            values[wire] = n_garbled
+            n_garbled += 1
+
+        backend = get_cipher(cipher)
+        results = {}
+        for gates in levels:
+            tasks = []
+            for gate in gates:
+                wire = n_terminals + gate
+                input_wires = compiled.inputs(gate)
+                inputs = [values[w] for w in input_wires]
+                pin = [passwords[w] for w in input_wires]
+                gate_type = compiled.gate_type(gate)
+                is_root = wire in roots
+                is_free = offset is not None and _is_linear(gate_type)
+                if is_free and not is_root and any(type(x) != bool for x in inputs):
+                    results[gate] = _garble_gate(gate_type, inputs, pin, mode, values[wire], offset, backend,
+                                                 is_free, is_root)
+                else:
+                    tasks.append((gate, gate_type, inputs, pin, values[wire], is_free, is_root))
+
+            if len(tasks) < PARALLEL_THRESHOLD:
+                garbled = _garble_gates(tasks, mode, offset, cipher)
+            else:
+                size = (len(tasks) + workers - 1) // workers
+                batches = [tasks[i:i + size] for i in range(0, len(tasks), size)]
+                executor = _executor(workers)
+                garbled = [item for batch in executor.map(_garble_gates, batches, [mode] * len(batches),
+                                                          [offset] * len(batches), [cipher] * len(batches))
+                           for item in batch]
+            results.update(zip([task[0] for task in tasks], garbled))
+
+            for gate in gates:
+                passwords[n_terminals + gate] = results[gate][1]
+        return results
 
     @staticmethod
-    def _dfs_construct(node, input_passwords, assignments, is_root=False) -> Tuple[GarbledGate | Terminal, List[bytes] | None] :
-        """
-        Helper function to recursively construct the garbled circuit.
-        Returns a garbled gate or terminal and the passwords for the outputs.
-        No passwords are returned for the root node as we directly output the value
-        """
-        if type(node) == Terminal:
-            if node in input_passwords:
-                return node, input_passwords[node]
-            elif node in assignments:
-                val = assignments[node]
-                return val, None
+    def from_stream(stream: Iterable) -> GarbledCircuit:
+        """
+        Assembles the pieces yielded by garble_stream into a complete garbled circuit.
+        """
+        stream = iter(stream)
+        garbled_circuit = next(stream)
+        for item in stream:
+            if isinstance(item, GarbledChunk):
+                garbled_circuit.gates.extend(item.gates)
             else:
-                raise ValueError(f"Terminal {node} not found in input_passwords or assignments")
-        else:
-            passwords = []
-            inputs = []
-            for input in node.inputs:
-                garbled_gate, password = GarbledCircuit._dfs_construct(input, input_passwords, assignments)
-                inputs.append(garbled_gate)
-                passwords.append(password)
+                garbled_circuit.output = item
+        return garbled_circuit
+
+    def serialize(self) -> bytes:
+        """
+        Binary encoding of the garbled circuit:
+            - the header: format version, mode, cipher and number of terminals (CIRCUIT_HEADER)
+            - the name of every terminal, as a length (NAME_LENGTH) followed by its UTF-8 encoding
+            - the output (see serialize_output)
+            - the gates, encoded as one GarbledChunk
+        A circuit without gates and output is the header of a garbled circuit stream.
+        """
+        parts = [CIRCUIT_HEADER.pack(FORMAT_VERSION, MODES.index(self.mode), CIPHER_NAMES.index(self.cipher),
+                                     len(self.terminals))]
+        parts.extend(_pack_name(t) for t in self.terminals)
+        parts.append(GarbledCircuit.serialize_output(self.output))
+        parts.append(GarbledChunk(self.gates, []).serialize())
+        return b''.join(parts)
+
+    @staticmethod
+    def deserialize(buffer) -> GarbledCircuit:
+        """
+        Decodes a garbled circuit encoded with serialize. buffer is any bytes-like object.
+        The rows of the garbled truth tables are memoryview slices of buffer, they are not copied.
+        Raises ValueError if the encoding is malformed.
+        """
+        view = memoryview(buffer)
+        version, mode, cipher, n_terminals = _unpack(CIRCUIT_HEADER, view, 0)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported garbled circuit format version: {version}")
+        if mode >= len(MODES) or cipher >= len(CIPHER_NAMES):
+            raise ValueError("Unsupported garbling mode or cipher")
+
+        offset = CIRCUIT_HEADER.size
+        terminals = []
+        for _ in range(n_terminals):
+            terminal, offset = _unpack_name(view, offset)
+            terminals.append(terminal)
+
+        output, offset = _unpack_output(view, offset)
+        chunk = GarbledChunk.deserialize(view[offset:])
+        return GarbledCircuit(terminals, chunk.gates, output, MODES[mode], CIPHER_NAMES[cipher])
+
+    @staticmethod
+    def serialize_output(output) -> bytes:
+        """
+        Binary encoding of the output (see GarbledCircuit.output) as a kind (see OUTPUT_*) and a value (OUTPUT):
+        the wire id for OUTPUT_WIRE, the wire id shifted left by one bit with d in the low bit for OUTPUT_SELECT.
+        A list is encoded as OUTPUT_LIST with the number of outputs as value, followed by the outputs.
+        """
+        if type(output) == list:
+            return b''.join([OUTPUT.pack(OUTPUT_LIST, len(output))] +
+                            [GarbledCircuit.serialize_output(x) for x in output])
+        if output is None:
+            return OUTPUT.pack(OUTPUT_NONE, 0)
+        if type(output) == bool:
+            return OUTPUT.pack(OUTPUT_TRUE if output else OUTPUT_FALSE, 0)
+        if type(output) == tuple:
+            wire, d = output
+            return OUTPUT.pack(OUTPUT_SELECT, wire << 1 | d)
+        return OUTPUT.pack(OUTPUT_WIRE, output)
+
+    @staticmethod
+    def deserialize_output(buffer):
+        view = memoryview(buffer)
+        output, offset = _unpack_output(view, 0)
+        if offset != len(view):
+            raise ValueError("Output length does not match its encoding")
+        return output
+
+    @staticmethod
+    def serialize_passwords(passwords: Dict[Terminal, bytes]) -> bytes:
+        """
+        Binary encoding of one password per terminal, e.g. the passwords of Alice's assignment:
+        the header (PASSWORDS_HEADER), then the name of every terminal (as in serialize) followed by its password.
+        """
+        parts = [PASSWORDS_HEADER.pack(FORMAT_VERSION, len(passwords))]
+        for t, password in passwords.items():
+            if len(password) != PASSWORD_LENGTH:
+                raise ValueError(f"Password of terminal {t} has the wrong length")
+            parts.append(_pack_name(t))
+            parts.append(password)
+        return b''.join(parts)
+
+    @staticmethod
+    def deserialize_passwords(buffer) -> Tuple[Dict[Terminal, bytes], memoryview]:
+        """
+        Returns (passwords, rest) where rest is the part of buffer after the passwords.
+        Raises ValueError if the encoding is malformed.
+        """
+        view = memoryview(buffer)
+        version, n_terminals = _unpack(PASSWORDS_HEADER, view, 0)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported garbled circuit format version: {version}")
+        offset = PASSWORDS_HEADER.size
+        passwords = {}
+        for _ in range(n_terminals):
+            terminal, offset = _unpack_name(view, offset)
+            passwords[terminal] = bytes(_slice(view, offset, PASSWORD_LENGTH))
+            offset += PASSWORD_LENGTH
+        return passwords, view[offset:]
+
+    @staticmethod
+    def random_password() -> bytes:
+        """
+        Generate a random password. Use random_password_pair to generate the two passwords of a terminal.
+        """
+        return os.urandom(PASSWORD_LENGTH)
 
-            output_passwords = [GarbledCircuit.random_password(), GarbledCircuit.random_password()] if not is_root else None
-            garbled_gate = GarbledGate.garble(node, inputs, passwords, output_passwords)
-            return garbled_gate, output_passwords
+    @staticmethod
+    def random_offset() -> bytes:
+        """
+        Generate a random global offset for Free-XOR.
+        Its select bit is 1, so that the two passwords of every wire have different select bits.
+        """
+        offset = bytearray(os.urandom(PASSWORD_LENGTH))
+        offset[-1] |= 1
+        return bytes(offset)
 
+    @staticmethod
+    def random_password_pair(offset: bytes | None = None) -> List[bytes]:
+        """
+        Generate the two passwords of a wire. If offset is given, the pair is [p, p ^ offset]
+        so that the circuit can be garbled with Free-XOR.
+        The two passwords always have different select bits (see GarbledGate.select_bit).
+        """
+        password = GarbledCircuit.random_password()
+        if offset is None:
+            other = bytearray(GarbledCircuit.random_password())
+            other[-1] = (other[-1] & 0xfe) | (1 - GarbledGate.select_bit(password))
+            return [password, bytes(other)]
+        return [password, GarbledGate._xor(password, offset)]
+
+    @staticmethod
+    def _free_xor_offset(input_passwords: Dict[Terminal, List[bytes]]) -> bytes | None:
+        """
+        Returns the global offset shared by all input password pairs, or None if they do not share one
+        or its select bit is 0.
+        If there are no input passwords, a fresh offset is generated.
+        """
+        offsets = {GarbledGate._xor(p0, p1) for p0, p1 in input_passwords.values()}
+        if not offsets:
+            return GarbledCircuit.random_offset()
+        if len(offsets) != 1:
+            return None
+        offset = offsets.pop()
+        # Outputs are decoded from select bits (see the class docstring), so the two passwords of every wire,
+        # free gate outputs included, must have different select bits
+        return offset if GarbledGate.select_bit(offset) else None
 
-    def evaluate(self, passwords) -> bool:
+    def evaluate(self, passwords, workers: int | None = None, threshold: int = PARALLEL_THRESHOLD) -> bool | List[bool]:
         """
         Evaluate the garbled circuit with the given passwords.
         assignments is a dictionary of terminal -> password.
+        Returns the value of the output, or the list of the values of the outputs if there are several.
+        With workers > 1, the gates of a level are evaluated in parallel (see StreamingEvaluator).
+        """
+
+        if type(self.output) == bool:
+            return self.output
+
+        evaluator = StreamingEvaluator(self, passwords, workers, threshold)
+        evaluator.evaluate_chunk(GarbledChunk(self.gates, []))
+        return evaluator.result(self.output)
+
+
+class GarbledChunk:
+    """
+    Consecutive gates of a garbled circuit, as produced by GarbledCircuit.garble_stream.
+    release lists the wires that are not read by any gate after this chunk.
+    """
+    def __init__(self, gates: List[GarbledGate], release: List[int]):
+        self.gates = gates
+        self.release = release
+
+    def serialize(self) -> bytes:
         """
+        Binary encoding of the chunk. After the header (CHUNK_HEADER) follow:
+            - the released wires (uint32 each)
+            - the gate index table: the number of inputs (uint8), the layout (uint8, see LAYOUT_*),
+              the number of rows (uint16) and the size of a row (uint16) of every gate, as four arrays
+            - the input wires of all gates (uint32 each)
+            - the rows of all gates, back to back
+        Classic rows are the key, the ciphertext and the nonce concatenated, sorted by key so that their order
+        does not depend on the assignments they encrypt.
+        Arrays are little-endian.
+        """
+        n_inputs, layouts, n_rows, row_sizes, inputs, rows = array('B'), array('B'), array('H'), array('H'), array('I'), []
+        for gate in self.gates:
+            table = gate.truth_table
+            if table is None:
+                layout, gate_rows = LAYOUT_FREE, []
+            elif type(table) == dict:
+                layout, gate_rows = LAYOUT_CLASSIC, [key + ct + nonce for key, (ct, nonce) in sorted(table.items())]
+            else:
+                layout, gate_rows = LAYOUT_ROWS, table
+            row_size = len(gate_rows[0]) if gate_rows else 0
+            if any(len(row) != row_size for row in gate_rows):
+                raise ValueError("Rows of a garbled gate must have the same size")
 
-        return self._dfs_evaluate(self.output, passwords)
+            n_inputs.append(len(gate.inputs))
+            layouts.append(layout)
+            n_rows.append(len(gate_rows))
+            row_sizes.append(row_size)
+            inputs.extend(gate.inputs)
+            rows.extend(gate_rows)
 
-    def _dfs_evaluate(self, node: GarbledGate | Terminal, passwords) -> bytes | bool:
+        return b''.join([CHUNK_HEADER.pack(FORMAT_VERSION, len(self.gates), len(self.release)),
+                         _pack_array(array('I', self.release)), _pack_array(n_inputs), _pack_array(layouts),
+                         _pack_array(n_rows), _pack_array(row_sizes), _pack_array(inputs)] + rows)
+
+    @staticmethod
+    def deserialize(buffer) -> GarbledChunk:
         """
-        Helper to recursively evaluate the garbled circuit.
-        Returns a password or boolean value.
+        Decodes a chunk encoded with serialize. buffer is any bytes-like object.
+        The rows of the garbled truth tables are memoryview slices of buffer, they are not copied.
+        Raises ValueError if the encoding is malformed.
         """
-        if type(node) == Terminal:
-            if node not in passwords:
-                raise ValueError(f"Terminal {node} not found in passwords")
-            return passwords[node]
+        view = memoryview(buffer)
+        version, n_gates, n_release = _unpack(CHUNK_HEADER, view, 0)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported garbled chunk format version: {version}")
+
+        offset = CHUNK_HEADER.size
+        release, offset = _unpack_array('I', view, offset, n_release)
+        n_inputs, offset = _unpack_array('B', view, offset, n_gates)
+        layouts, offset = _unpack_array('B', view, offset, n_gates)
+        n_rows, offset = _unpack_array('H', view, offset, n_gates)
+        row_sizes, offset = _unpack_array('H', view, offset, n_gates)
+        inputs, offset = _unpack_array('I', view, offset, sum(n_inputs))
+
+        if offset + sum(map(int.__mul__, n_rows, row_sizes)) != len(view):
+            raise ValueError("Garbled chunk length does not match its gate index table")
+
+        inputs = inputs.tolist()
+        gates = []
+        start = 0
+        for gate in range(n_gates):
+            end = start + n_inputs[gate]
+            gate_inputs = inputs[start:end]
+            start = end
+
+            layout = layouts[gate]
+            if layout == LAYOUT_FREE:
+                table = None
+            else:
+                size = row_sizes[gate]
+                end = offset + n_rows[gate] * size
+                table = [view[i:i + size] for i in range(offset, end, size)] if size else [b''] * n_rows[gate]
+                offset = end
+                if layout == LAYOUT_CLASSIC:
+                    if size <= CLASSIC_KEY_LENGTH + CLASSIC_NONCE_LENGTH:
+                        raise ValueError("Invalid classic row size")
+                    table = {bytes(row[:CLASSIC_KEY_LENGTH]): (row[CLASSIC_KEY_LENGTH:-CLASSIC_NONCE_LENGTH],
+                                                               bytes(row[-CLASSIC_NONCE_LENGTH:])) for row in table}
+                elif layout != LAYOUT_ROWS:
+                    raise ValueError(f"Invalid garbled gate layout: {layout}")
+            gates.append(GarbledGate(gate_inputs, table))
+
+        return GarbledChunk(gates, release.tolist())
+
+
+class StreamingEvaluator:
+    """
+    Evaluates a garbled circuit chunk by chunk, while it is being received.
+
+        evaluator = StreamingEvaluator(header, passwords)  # header is the first item of GarbledCircuit.garble_stream
+        evaluator.evaluate_chunk(chunk)                    # for every chunk, in order
+        value = evaluator.result(output)                   # output is the last item of the stream
+
+    Only the passwords of wires that may still be read are kept, the passwords of released wires
+    and the garbled tables of evaluated gates are dropped.
+
+    With workers > 1, a chunk of at least threshold gates is evaluated level by level: the gates of a chunk
+    are grouped by their depth within the chunk, and the gates with a garbled table of a level are split
+    across a pool of worker processes if there are at least threshold of them. Smaller chunks and levels
+    are evaluated serially.
+    """
+    def __init__(self, garbled_circuit: GarbledCircuit, passwords: Dict[Terminal, bytes], workers: int | None = None,
+                 threshold: int = PARALLEL_THRESHOLD):
+        self.mode = garbled_circuit.mode
+        self.cipher_name = garbled_circuit.cipher
+        self.cipher = get_cipher(garbled_circuit.cipher)
+        self.workers = workers
+        self.threshold = threshold
+        self.wires = {}
+        for i, t in enumerate(garbled_circuit.terminals):
+            if t not in passwords:
+                raise ValueError(f"Terminal {t} not found in passwords")
+            self.wires[i] = passwords[t]
+        self.n_wires = len(garbled_circuit.terminals)
+
+    def evaluate_chunk(self, chunk: GarbledChunk):
+        wires = self.wires
+        if self.workers is not None and self.workers > 1 and len(chunk.gates) >= self.threshold:
+            self._evaluate_levels(chunk.gates)
         else:
-            input_passwords = [self._dfs_evaluate(input, passwords) for input in node.inputs]
-            return node.evaluate(input_passwords)
\ No newline at end of file
+            for gate in chunk.gates:
+                for w in gate.inputs:
+                    if w not in wires:
+                        raise ValueError(f"Gate {self.n_wires} reads wire {w}, which is not available")
+                wires[self.n_wires] = gate.evaluate([wires[w] for w in gate.inputs], self.mode, self.n_wires,
+                                                    self.cipher)
+                self.n_wires += 1
+        for w in chunk.release:
+            wires.pop(w, None)
+
+    def _evaluate_levels(self, gates: List[GarbledGate]):
+        wires = self.wires
+        first = self.n_wires
+        depth = {}
+        levels = []
+        for i, gate in enumerate(gates):
+            for w in gate.inputs:
+                if not (w in wires or first <= w < first + i):
+                    raise ValueError(f"Gate {first + i} reads wire {w}, which is not available")
+            level = 1 + max((depth.get(w, 0) for w in gate.inputs), default=0)
+            depth[first + i] = level
+            if level > len(levels):
+                levels.append([])
+            levels[level - 1].append(i)
+
+        for level in levels:
+            tasks = []
+            for i in level:
+                gate = gates[i]
+                pin = [wires[w] for w in gate.inputs]
+                if gate.truth_table is None:
+                    wires[first + i] = gate.evaluate(pin, self.mode, first + i, self.cipher)
+                else:
+                    tasks.append((i, gate, pin))
+
+            if len(tasks) < self.threshold:
+                for i, gate, pin in tasks:
+                    wires[first + i] = gate.evaluate(pin, self.mode, first + i, self.cipher)
+                continue
+            size = (len(tasks) + self.workers - 1) // self.workers
+            batches = [[(_detach(gate), pin, first + i) for i, gate, pin in tasks[j:j + size]]
+                       for j in range(0, len(tasks), size)]
+            results = _executor(self.workers).map(_evaluate_gates, batches, [self.mode] * len(batches),
+                                                  [self.cipher_name] * len(batches))
+            for (i, _, _), password in zip(tasks, (password for batch in results for password in batch)):
+                wires[first + i] = password
+        self.n_wires += len(gates)
+
+    def result(self, output) -> bool | List[bool]:
+        if type(output) == list:
+            return [self.result(x) for x in output]
+        if type(output) == bool:
+            return output
+        wire = output[0] if type(output) == tuple else output
+        if wire not in self.wires:
+            raise ValueError(f"Output wire {wire} has not been evaluated")
+        if type(output) == tuple:
+            return bool(GarbledGate.select_bit(self.wires[wire]) ^ output[1])
+        return self.wires[wire]
+
+
+@lru_cache(maxsize=None)
+def _is_linear(gate_type) -> bool:
+    return GarbledGate.is_linear(gate_type.truth_table())
+
+def _garble_gate(gate_type, inputs: List[int | bool], pin: List[List[bytes] | None], mode: str, tweak: int,
+                 offset: bytes | None, backend, is_free: bool, is_root: bool) -> Tuple[GarbledGate, List[bytes] | None]:
+    """
+    Garbles one gate of garble_stream. Returns the garbled gate and the passwords of its output.
+    """
+    if is_free and not is_root and any(type(x) != bool for x in inputs):
+        return GarbledGate.garble_free(gate_type, inputs, pin, offset)
+    if mode in [GRR3, HALF_GATES] and not is_root:
+        return GarbledGate.garble_reduced(gate_type, inputs, pin, mode, tweak, offset, backend)
+    output_passwords = GarbledCircuit.random_password_pair(offset) if not is_root else None
+    return GarbledGate.garble(gate_type, inputs, pin, output_passwords, mode, tweak, backend), output_passwords
+
+def _garble_gates(tasks: List[Tuple], mode: str, offset: bytes | None, cipher: str) -> List[Tuple]:
+    """
+    Garbles a batch of gates of one level (see GarbledCircuit._garble_levels), in a worker process.
+    """
+    backend = get_cipher(cipher)
+    return [_garble_gate(gate_type, inputs, pin, mode, tweak, offset, backend, is_free, is_root)
+            for _, gate_type, inputs, pin, tweak, is_free, is_root in tasks]
+
+def _evaluate_gates(tasks: List[Tuple], mode: str, cipher: str) -> List[bytes | bool]:
+    """
+    Evaluates a batch of gates of one level (see StreamingEvaluator._evaluate_levels), in a worker process.
+    """
+    backend = get_cipher(cipher)
+    return [gate.evaluate(pin, mode, tweak, backend) for gate, pin, tweak in tasks]
+
+def _detach(gate: GarbledGate) -> GarbledGate:
+    """
+    Copy of a gate whose rows are bytes instead of memoryview slices of a received buffer, so it can be pickled.
+    """
+    table = gate.truth_table
+    if type(table) == dict:
+        table = {key: (bytes(ct), nonce) for key, (ct, nonce) in table.items()}
+    elif table is not None:
+        table = [bytes(row) for row in table]
+    return GarbledGate(gate.inputs, table)
+
+def _executor(workers: int) -> ProcessPoolExecutor:
+    with _executors_lock:
+        if workers not in _executors:
+            context = multiprocessing.get_context('forkserver')
+            _executors[workers] = ProcessPoolExecutor(workers, mp_context=context)
+        return _executors[workers]
+
+def _unpack_output(view: memoryview, offset: int, nested: bool = False) -> Tuple:
+    """
+    Decodes an output encoded with GarbledCircuit.serialize_output. Returns (output, offset after it).
+    """
+    kind, value = _unpack(OUTPUT, view, offset)
+    offset += OUTPUT.size
+    if kind == OUTPUT_LIST and not nested:
+        if value == 0:
+            raise ValueError("Empty list of outputs")
+        outputs = []
+        for _ in range(value):
+            output, offset = _unpack_output(view, offset, True)
+            outputs.append(output)
+        return outputs, offset
+    if kind == OUTPUT_WIRE:
+        return value, offset
+    if kind == OUTPUT_SELECT:
+        return (value >> 1, value & 1), offset
+    if kind in [OUTPUT_FALSE, OUTPUT_TRUE]:
+        return kind == OUTPUT_TRUE, offset
+    if kind == OUTPUT_NONE and not nested:
+        return None, offset
+    raise ValueError(f"Invalid output kind: {kind}")
+
+def _unpack(header: struct.Struct, view: memoryview, offset: int) -> Tuple:
+    if offset + header.size > len(view):
+        raise ValueError("Truncated garbled circuit encoding")
+    return header.unpack_from(view, offset)
+
+def _slice(view: memoryview, offset: int, length: int) -> memoryview:
+    if offset + length > len(view):
+        raise ValueError("Truncated garbled circuit encoding")
+    return view[offset:offset + length]
+
+def _pack_name(terminal: Terminal) -> bytes:
+    name = str(terminal.name).encode()
+    return NAME_LENGTH.pack(len(name)) + name
+
+def _unpack_name(view: memoryview, offset: int) -> Tuple[Terminal, int]:
+    length, = _unpack(NAME_LENGTH, view, offset)
+    offset += NAME_LENGTH.size
+    return Terminal(bytes(_slice(view, offset, length)).decode()), offset + length
+
+def _pack_array(values: array) -> bytes:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _unpack_array(typecode: str, view: memoryview, offset: int, count: int) -> Tuple[array, int]:
+    values = array(typecode)
+    length = count * values.itemsize
+    values.frombytes(_slice(view, offset, length))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values, offset + length
@@ -1,37 +1,66 @@
 from __future__ import annotations
 
-import secrets
-import string
-from typing import Self, List, Dict, Tuple
+import os
+from typing import List, Dict, Tuple, Type
 from Crypto.Hash import SHA256
-from circuits.elements import Gate, Terminal
+from circuits.elements import Gate
 from Crypto.Cipher import Salsa20
+from garbled_circuits.ciphers import CipherBackend, CIPHERS, DEFAULT_CIPHER
+
+# Garbling modes
+CLASSIC = 'classic'
+POINT_AND_PERMUTE = 'point-and-permute'
+GRR3 = 'grr3'
+HALF_GATES = 'half-gates'
+MODES = [CLASSIC, POINT_AND_PERMUTE, GRR3, HALF_GATES]
+# Default mode of the library: the rows are encrypted with the cipher backend and any passwords generated with
+# GarbledCircuit.random_password_pair can be used. Classic mode keeps the original construction.
+DEFAULT_MODE = POINT_AND_PERMUTE
+
+PASSWORD_LENGTH = 32
+
 
 class GarbledGate:
     """
     Represents a garbled gate in a garbled circuit. Has multiple inputs and one output.
-    inputs is a list of input garbled gates/terminals
-    truth_table is a dictionary mapping the input passwords to the output passwords.
+    inputs is a list of input wire ids in the garbled circuit
+    truth_table depends on the garbling mode:
+        - classic: a dictionary mapping the hash of the input passwords to the encrypted output password and nonce.
+        - point-and-permute: a list of encrypted output passwords, indexed by the select bits of the input passwords.
+        - grr3: like point-and-permute, but row 0 is not stored. The output password of row 0 is the hash of its
+          input passwords, so a gate with k inputs has 2^k - 1 rows.
+        - half-gates: two-input gates computing ((a ^ alpha) & (b ^ beta)) ^ gamma, e.g. AND and OR, have two
+          ciphertexts [TG, TE] (garbler and evaluator half gates). Other gates are garbled as in grr3.
+        In the grr3 and half-gates modes, the output gate of the circuit uses the point-and-permute layout.
+        The layout of a gate is recognized from its number of inputs and rows.
+
+    Except in classic mode, rows are encrypted by XORing them with a pad derived by a cipher backend
+    (see garbled_circuits.ciphers). Rows use the tweak (wire id << 2), the two half gates use
+    (wire id << 2) | 1 and (wire id << 2) | 2.
+    If truth_table is None, the gate is a free XOR gate: its output password is the XOR of the input passwords.
     """
 
-    def __init__(self, inputs: List[Self | Terminal], truth_table: Dict[bytes, Tuple[bytes, bytes]]):
+    def __init__(self, inputs: List[int], truth_table: Dict[bytes, Tuple[bytes, bytes]] | List[bytes] | None):
         self.inputs = inputs
         self.truth_table = truth_table
-        self.identifier = ''.join(secrets.choice(string.ascii_lowercase) for _ in range(8))
 
     @staticmethod
-    def garble(gate: Gate, inputs: List[GarbledGate | Terminal | bool],
-               pin: List[List[bytes]], pout: List[bytes] | None) -> GarbledGate:
+    def garble(gate: Type[Gate], inputs: List[int | bool],
+               pin: List[List[bytes]], pout: List[bytes] | None,
+               mode: str = DEFAULT_MODE, tweak: int = 0, cipher: CipherBackend = CIPHERS[DEFAULT_CIPHER]) -> GarbledGate:
         """
         Construct a garbled gate given the input and output passwords and the underlying gate + inputs.
 
-        - gate is the underlying gate
-        - inputs is a list of garbled gates/terminals/bool
+        - gate is the type of the underlying gate
+        - inputs is a list of garbled wire ids/bool
         - Each element in pin is a list of two passwords
             - pin[i] is a list of two passwords for the ith input, one for 0 and one for 1
             - If the ith input is a boolean, we do not need the passwords for it., pin[i] is ignored (should be None)
         - pout is a list of two passwords for the output, one for 0 and one for 1
             -if pout is None, then True/False is used as the output
+        - mode is the garbling mode (see MODES)
+        - tweak is a number unique to the gate within the circuit (its output wire id), mixed into the row keys
+        - cipher is the backend deriving the row pads (not used in classic mode)
         """
 
 
@@ -40,33 +69,210 @@ class GarbledGate:
         reduced_truth_table = GarbledGate.reduce_truth_table(truth_table, assignments)
 
         reduced_inputs = [inputs[i] for i in range(len(inputs)) if type(inputs[i]) != bool]
-        reduces_idxs = [ i for i in range(len(inputs)) if type(inputs[i]) != bool]
+        reduced_pin = [pin[i] for i in range(len(inputs)) if type(inputs[i]) != bool]
+        outputs = [GarbledGate._to_bytes(v if pout is None else pout[v]) for v in reduced_truth_table]
+
+        if mode == CLASSIC:
+            garbled_truth_table = GarbledGate._garble_classic(reduced_pin, outputs)
+        elif mode == POINT_AND_PERMUTE or (mode in [GRR3, HALF_GATES] and pout is None):
+            garbled_truth_table = GarbledGate._garble_point_and_permute(reduced_pin, outputs, tweak, cipher)
+        elif mode in [GRR3, HALF_GATES]:
+            raise ValueError(f"Output passwords are chosen by the gate in {mode} mode, use garble_reduced")
+        else:
+            raise ValueError(f"Unsupported garbling mode: {mode}")
+
+        garbled_gate = GarbledGate(reduced_inputs, garbled_truth_table)
+        return garbled_gate
+
+    @staticmethod
+    def _garble_classic(pin: List[List[bytes]], outputs: List[bytes]) -> Dict[bytes, Tuple[bytes, bytes]]:
+        """
+        Each row is keyed by the hash of its input passwords and holds the output encrypted with a fresh nonce.
+        The evaluator finds its row by hashing the passwords it holds.
+        """
         garbled_truth_table = {}
 
-        k = len(reduced_inputs)
+        k = len(pin)
         for mask in range(1 << k):
-            key = b''.join(pin[reduces_idxs[i]][mask >> i & 1] for i in range(k))
+            key = b''.join(pin[i][mask >> i & 1] for i in range(k))
             hashed_key = SHA256.new(data=key).digest()
 
-            val = reduced_truth_table[mask] if pout is None else pout[reduced_truth_table[mask]]
-            val = GarbledGate._to_bytes(val)
-
             encryption_key = GarbledGate._wrap(hashed_key, 32)
             cipher = Salsa20.new(encryption_key)
-            ct = cipher.encrypt(val)
+            ct = cipher.encrypt(outputs[mask])
             nonce = cipher.nonce
             garbled_truth_table[hashed_key] = (ct, nonce)
 
-        garbled_gate = GarbledGate(reduced_inputs, garbled_truth_table)
-        return garbled_gate
+        return garbled_truth_table
 
+    @staticmethod
+    def _garble_point_and_permute(pin: List[List[bytes]], outputs: List[bytes], tweak: int,
+                                  cipher: CipherBackend) -> List[bytes]:
+        """
+        Point-and-permute: the select bits of the input passwords (see select_bit) give the row index.
+        The two passwords of every wire have different select bits, so each row is used by exactly one
+        assignment of the inputs, and the rows are stored as a list of ciphertexts in row order.
+        """
+        k = len(pin)
+        rows = [[pin[i][mask >> i & 1] for i in range(k)] for mask in range(1 << k)]
+        pads = cipher.pads([(passwords, tweak << 2, len(outputs[mask])) for mask, passwords in enumerate(rows)])
 
+        garbled_truth_table = [b''] * (1 << k)
+        for mask, passwords in enumerate(rows):
+            garbled_truth_table[GarbledGate._row(passwords)] = GarbledGate._xor(pads[mask], outputs[mask])
+        return garbled_truth_table
 
-    def evaluate(self, pin:List[bytes]) -> bytes|bool:
+    @staticmethod
+    def garble_reduced(gate: Type[Gate], inputs: List[int | bool], pin: List[List[bytes]],
+                       mode: str, tweak: int, offset: bytes | None,
+                       cipher: CipherBackend = CIPHERS[DEFAULT_CIPHER]) -> Tuple[GarbledGate, List[bytes]]:
+        """
+        Garbles a gate in grr3 or half-gates mode. In these modes, the output passwords are derived
+        from the input passwords instead of being chosen beforehand.
+        offset is the global Free-XOR offset, required for half-gates.
+        Returns the garbled gate and the passwords for its output.
+        """
+        truth_table = gate.truth_table()
+        assignments = [inputs[i] if type(inputs[i]) == bool else None for i in range(len(inputs))]
+        reduced_truth_table = GarbledGate.reduce_truth_table(truth_table, assignments)
+
+        reduced_inputs = [inputs[i] for i in range(len(inputs)) if type(inputs[i]) != bool]
+        reduced_pin = [pin[i] for i in range(len(inputs)) if type(inputs[i]) != bool]
+
+        # Only decided by the gate type and the number of garbled inputs, never by the values of the assignment
+        form = GarbledGate._half_gate_form(truth_table) if len(reduced_inputs) == len(inputs) == 2 else None
+        if mode == HALF_GATES and form is not None:
+            if offset is None:
+                raise ValueError("half-gates mode requires a Free-XOR offset")
+            garbled_truth_table, pout = GarbledGate._garble_half_gate(reduced_pin, form, tweak, offset, cipher)
+        elif mode in [GRR3, HALF_GATES]:
+            garbled_truth_table, pout = GarbledGate._garble_grr3(reduced_pin, reduced_truth_table, tweak, offset, cipher)
+        else:
+            raise ValueError(f"Unsupported garbling mode: {mode}")
+
+        return GarbledGate(reduced_inputs, garbled_truth_table), pout
+
+    @staticmethod
+    def _garble_grr3(pin: List[List[bytes]], truth_table: List[bool], tweak: int,
+                     offset: bytes | None, cipher: CipherBackend) -> Tuple[List[bytes], List[bytes]]:
+        """
+        Garbled row reduction: the output password of row 0 is the pad of row 0, so row 0 need not be sent.
+        The other output password is derived with the Free-XOR offset, or is random with the opposite select bit.
+        """
+        k = len(pin)
+        rows = [None] * (1 << k)
+        for mask in range(1 << k):
+            passwords = [pin[i][mask >> i & 1] for i in range(k)]
+            rows[GarbledGate._row(passwords)] = (passwords, truth_table[mask])
+
+        pads = cipher.pads([(passwords, tweak << 2, PASSWORD_LENGTH) for passwords, _ in rows])
+        password, value = pads[0], rows[0][1]
+        if offset is not None:
+            other = GarbledGate._xor(password, offset)
+        else:
+            other = bytearray(os.urandom(PASSWORD_LENGTH))
+            other[-1] = (other[-1] & 0xfe) | (1 - GarbledGate.select_bit(password))
+            other = bytes(other)
+        pout = [other, password] if value else [password, other]
+
+        garbled_truth_table = [GarbledGate._xor(pads[row], pout[rows[row][1]]) for row in range(1, 1 << k)]
+        return garbled_truth_table, pout
+
+    @staticmethod
+    def _garble_half_gate(pin: List[List[bytes]], form: Tuple[int, int, int], tweak: int,
+                          offset: bytes, cipher: CipherBackend) -> Tuple[List[bytes], List[bytes]]:
+        """
+        Half-gates garbling (Zahur, Rosulek, Evans) of ((a ^ alpha) & (b ^ beta)) ^ gamma with two ciphertexts.
+        """
+        alpha, beta, gamma = form
+        xor = GarbledGate._xor
+
+        a0, b0 = pin[0][alpha], pin[1][beta]
+        a1, b1 = xor(a0, offset), xor(b0, offset)
+        pa, pb = GarbledGate.select_bit(a0), GarbledGate.select_bit(b0)
+
+        ha0, ha1, hb0, hb1 = cipher.pads([([a0], tweak << 2 | 1, PASSWORD_LENGTH), ([a1], tweak << 2 | 1, PASSWORD_LENGTH),
+                                          ([b0], tweak << 2 | 2, PASSWORD_LENGTH), ([b1], tweak << 2 | 2, PASSWORD_LENGTH)])
+
+        # Garbler half gate
+        tg = xor(ha0, ha1, offset) if pb else xor(ha0, ha1)
+        wg0 = xor(ha0, tg) if pa else ha0
+
+        # Evaluator half gate
+        te = xor(hb0, hb1, a0)
+        we0 = xor(hb0, te, a0) if pb else hb0
+
+        zero = xor(wg0, we0, offset) if gamma else xor(wg0, we0)
+        return [tg, te], [zero, xor(zero, offset)]
+
+    @staticmethod
+    def _half_gate_form(truth_table: List[bool]) -> Tuple[int, int, int] | None:
+        """
+        Writes a two-input truth table as ((a ^ alpha) & (b ^ beta)) ^ gamma.
+        Returns (alpha, beta, gamma), or None if the truth table does not have an odd number of ones.
+        """
+        if len(truth_table) != 4:
+            return None
+        ones = [mask for mask in range(4) if truth_table[mask]]
+        if len(ones) == 1:
+            mask, gamma = ones[0], 0
+        elif len(ones) == 3:
+            mask, gamma = [mask for mask in range(4) if not truth_table[mask]][0], 1
+        else:
+            return None
+        return 1 - (mask & 1), 1 - (mask >> 1 & 1), gamma
+
+    @staticmethod
+    def garble_free(gate: Type[Gate], inputs: List[int | bool],
+                    pin: List[List[bytes]], offset: bytes) -> Tuple[GarbledGate, List[bytes]]:
+        """
+        Free-XOR garbling of a gate whose truth table is linear (see is_linear), e.g. XOR, XNOR, NOT and BUFFER.
+
+        All passwords pairs in the circuit are of the form [p, p ^ offset]. The output password for 0 is then
+        the XOR of the input passwords for 0, XORed with offset if the gate outputs 1 when all inputs are 0.
+        No truth table is needed, the evaluator just XORs the input passwords.
+        Returns the garbled gate and the passwords for its output.
+        """
+        assignments = [inputs[i] if type(inputs[i]) == bool else None for i in range(len(inputs))]
+        reduced_truth_table = GarbledGate.reduce_truth_table(gate.truth_table(), assignments)
+
+        reduced_inputs = [inputs[i] for i in range(len(inputs)) if type(inputs[i]) != bool]
+        zero = GarbledGate._xor(*[pin[i][0] for i in range(len(inputs)) if type(inputs[i]) != bool])
+        if reduced_truth_table[0]:
+            zero = GarbledGate._xor(zero, offset)
+
+        return GarbledGate(reduced_inputs, None), [zero, GarbledGate._xor(zero, offset)]
+
+    @staticmethod
+    def is_linear(truth_table: List[bool]) -> bool:
+        """
+        Returns True if the truth table is the XOR of all inputs, possibly negated.
+        Every reduction of such a truth table is linear as well, so such gates can be garbled for free.
+        """
+        return all(truth_table[mask] == truth_table[0] ^ (bin(mask).count('1') & 1) for mask in range(len(truth_table)))
+
+    def evaluate(self, pin:List[bytes], mode: str = DEFAULT_MODE, tweak: int = 0,
+                 cipher: CipherBackend = CIPHERS[DEFAULT_CIPHER]) -> bytes|bool:
         """
         Evaluate the garbled gate given the passwords for each input.
         pin is a list of passwords for each input.
+        mode, tweak and cipher must be the same as when the gate was garbled.
         """
+        if self.truth_table is None:
+            return self._xor(*pin)
+
+        if mode != CLASSIC:
+            k = len(self.truth_table)
+            if k == 1 << len(pin):
+                ct = self.truth_table[self._row(pin)]
+                return self.from_bytes(self._xor(cipher.pad(pin, tweak << 2, len(ct)), ct))
+            elif k == 2 and len(pin) == 2 and mode == HALF_GATES:
+                return self._evaluate_half_gate(pin, tweak, cipher)
+            elif k == (1 << len(pin)) - 1:
+                row = self._row(pin)
+                password = cipher.pad(pin, tweak << 2, PASSWORD_LENGTH)
+                return password if row == 0 else self._xor(password, self.truth_table[row - 1])
+            raise ValueError("Invalid garbled truth table")
 
         key = b''.join(pin[i] for i in range(len(pin)))
         key = SHA256.new(data=key).digest()
@@ -81,6 +287,40 @@ class GarbledGate:
         return self.from_bytes(val)
 
 
+    def _evaluate_half_gate(self, pin: List[bytes], tweak: int, cipher: CipherBackend) -> bytes:
+        a, b = pin
+        tg, te = self.truth_table
+        wg, we = cipher.pads([([a], tweak << 2 | 1, PASSWORD_LENGTH), ([b], tweak << 2 | 2, PASSWORD_LENGTH)])
+        if self.select_bit(a):
+            wg = self._xor(wg, tg)
+        if self.select_bit(b):
+            we = self._xor(we, te, a)
+        return self._xor(wg, we)
+
+    @staticmethod
+    def select_bit(password: bytes) -> int:
+        """
+        The select bit of a password used for point-and-permute: the lowest bit of its last byte.
+        """
+        return password[-1] & 1
+
+    @staticmethod
+    def _row(passwords: List[bytes]) -> int:
+        """
+        Row of the point-and-permute truth table selected by the given passwords.
+        """
+        return sum(GarbledGate.select_bit(p) << i for i, p in enumerate(passwords))
+
+    @staticmethod
+    def _xor(*blocks: bytes) -> bytes:
+        """
+        XOR of byte arrays of the same length
+        """
+        value = 0
+        for block in blocks:
+            value ^= int.from_bytes(block, 'big')
+        return value.to_bytes(len(blocks[0]), 'big')
+
     @staticmethod
     def _wrap(b: bytes, n: int) -> bytes:
         """
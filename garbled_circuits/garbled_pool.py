@@ -0,0 +1,125 @@
+from __future__ import annotations
+import os
+import struct
+import time
+from typing import Dict, List
+
+from circuits.circuit import Circuit
+from circuits.compiled import CompiledCircuit
+from circuits.elements import Terminal
+from garbled_circuits.ciphers import DEFAULT_CIPHER
+from garbled_circuits.garbled_circuit import GarbledCircuit
+from garbled_circuits.garbled_gate import HALF_GATES
+
+# Instance file: header followed by the passwords for 0 and for 1 of every terminal
+# (see GarbledCircuit.serialize_passwords) and the garbled circuit (see GarbledCircuit.serialize)
+FORMAT_VERSION = 1
+MAGIC = b'GCPL'
+INSTANCE_HEADER = struct.Struct('!4sB')  # magic, version
+INSTANCE_SUFFIX = '.gcpool'
+TAKEN_SUFFIX = '.taken'
+
+
+class PregarbledCircuit:
+    """
+    A circuit garbled before the assignments are known: every terminal, Alice's included, is an input
+    of the garbled circuit with a pair of passwords. Online, Alice sends the passwords of her assignment
+    (input_passwords) along with the garbled circuit, and Bob gets the passwords of his by oblivious transfer.
+
+    garbled_circuit is the serialized garbled circuit, so that sending it costs no more than I/O.
+    Its passwords must never be used for more than one evaluation.
+    """
+    def __init__(self, garbled_circuit: bytes, passwords: Dict[Terminal, List[bytes]]):
+        self.garbled_circuit = garbled_circuit
+        self.passwords = passwords
+
+    @staticmethod
+    def garble(circuit: Circuit | CompiledCircuit, mode: str = HALF_GATES, cipher: str = DEFAULT_CIPHER,
+               workers: int | None = None) -> PregarbledCircuit:
+        compiled = circuit if isinstance(circuit, CompiledCircuit) else circuit.compiled
+        offset = GarbledCircuit.random_offset()
+        passwords = {t: GarbledCircuit.random_password_pair(offset) for t in compiled.terminals}
+        garbled_circuit = GarbledCircuit.garble(compiled, {}, passwords, mode, cipher, workers)
+        return PregarbledCircuit(garbled_circuit.serialize(), passwords)
+
+    def input_passwords(self, assignment: Dict[Terminal, bool]) -> Dict[Terminal, bytes]:
+        """
+        The passwords of the assigned terminals for their values.
+        """
+        return {t: self.passwords[t][int(v)] for t, v in assignment.items()}
+
+    def serialize(self) -> bytes:
+        return b''.join([INSTANCE_HEADER.pack(MAGIC, FORMAT_VERSION),
+                         GarbledCircuit.serialize_passwords({t: p0 for t, (p0, _) in self.passwords.items()}),
+                         GarbledCircuit.serialize_passwords({t: p1 for t, (_, p1) in self.passwords.items()}),
+                         self.garbled_circuit])
+
+    @staticmethod
+    def deserialize(buffer) -> PregarbledCircuit:
+        """
+        Decodes serialize. The garbled circuit itself is not decoded.
+        Raises ValueError if the encoding is malformed.
+        """
+        view = memoryview(buffer)
+        if len(view) < INSTANCE_HEADER.size:
+            raise ValueError("Truncated pre-garbled circuit")
+        magic, version = INSTANCE_HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Invalid pre-garbled circuit")
+        passwords0, rest = GarbledCircuit.deserialize_passwords(view[INSTANCE_HEADER.size:])
+        passwords1, rest = GarbledCircuit.deserialize_passwords(rest)
+        if passwords0.keys() != passwords1.keys():
+            raise ValueError("Invalid pre-garbled circuit passwords")
+        return PregarbledCircuit(bytes(rest), {t: [passwords0[t], passwords1[t]] for t in passwords0})
+
+
+class GarbledPool:
+    """
+    Pre-garbled circuits stored in a directory, one file per instance, filled offline (see garbled_pool.py).
+    Instances are identified by the hash of their circuit file (see common.circuit_hash),
+    so a directory can hold instances of several circuits.
+
+        pool.add(digest, instance)      stores a PregarbledCircuit
+        pool.depth(digest)              number of unused instances of the circuit
+        pool.take(digest)               the oldest unused instance of the circuit, or None
+
+    Every instance is taken at most once, also by processes sharing the pool: take renames the file
+    before reading it, and only one rename of a file succeeds. The files hold both passwords of every
+    terminal, so they are only readable by their owner.
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def add(self, digest: bytes, instance: PregarbledCircuit):
+        name = f"{digest.hex()}-{time.time_ns():016x}{os.urandom(8).hex()}"
+        path = os.path.join(self.path, name + INSTANCE_SUFFIX)
+        fd = os.open(path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(instance.serialize())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def depth(self, digest: bytes) -> int:
+        return len(self._instances(digest))
+
+    def take(self, digest: bytes) -> PregarbledCircuit | None:
+        for name in self._instances(digest):
+            path = os.path.join(self.path, name)
+            taken = f"{path[:-len(INSTANCE_SUFFIX)]}.{os.getpid()}{TAKEN_SUFFIX}"
+            try:
+                os.rename(path, taken)
+            except FileNotFoundError:
+                # Taken by another process
+                continue
+            with open(taken, 'rb') as f:
+                data = f.read()
+            os.remove(taken)
+            return PregarbledCircuit.deserialize(data)
+        return None
+
+    def _instances(self, digest: bytes):
+        prefix = digest.hex() + '-'
+        return sorted(name for name in os.listdir(self.path)
+                      if name.startswith(prefix) and name.endswith(INSTANCE_SUFFIX))
@@ -0,0 +1,47 @@
+"""
+Offline phase of the garbling: fills a pool of pre-garbled circuits used by alice.py with --garbled-pool=DIR,
+and reports how many unused pre-garbled circuits it holds.
+
+Usage:
+    python garbled_pool.py fill <circuit_file> <pool_dir> <count> [--verbose] [--workers=N] [--lut=K]
+    python garbled_pool.py depth <circuit_file> <pool_dir>
+
+The circuits are garbled before the assignments are known, with passwords for the inputs of both parties.
+Every evaluation of alice.py with --garbled-pool consumes one pre-garbled circuit of its circuit file,
+online Alice only selects the passwords of her assignment. If the pool is empty, alice.py garbles online.
+"""
+
+import sys
+
+from common import log, circuit_hash, load_circuit_from_file, get_option
+from garbled_circuits.garbled_pool import GarbledPool, PregarbledCircuit
+
+def usage():
+    log(__doc__)
+    sys.exit(1)
+
+def fill(circuit_file, pool, count, workers=None, lut=None, verbose=False):
+    digest = circuit_hash(circuit_file)
+    circuit, _, _ = load_circuit_from_file(circuit_file, lut=lut, verbose=verbose)
+    for i in range(count):
+        pool.add(digest, PregarbledCircuit.garble(circuit, workers=workers))
+        if verbose:
+            log(f"Garbled {i + 1} of {count} circuits")
+    log(f"Added {count} pre-garbled circuits to {pool.path}, depth {pool.depth(digest)}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        usage()
+    command = sys.argv[1]
+    verbose = '--verbose' in sys.argv
+
+    if command == 'fill' and len(sys.argv) >= 5:
+        lut = get_option('lut')
+        fill(sys.argv[2], GarbledPool(sys.argv[3]), int(sys.argv[4]), int(get_option('workers', 1)),
+             int(lut) if lut else None, verbose)
+    elif command == 'depth':
+        pool = GarbledPool(sys.argv[3])
+        log(f"{pool.path}: {pool.depth(circuit_hash(sys.argv[2]))} unused pre-garbled circuits of {sys.argv[2]}")
+    else:
+        usage()
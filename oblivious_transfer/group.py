@@ -0,0 +1,79 @@
+from functools import lru_cache
+
+from Crypto.Hash import SHAKE256
+
+# 2048-bit MODP group of RFC 3526 (group 14). P is a safe prime, G = 2 generates the subgroup of order Q.
+P = int(
+    'FFFFFFFF' 'FFFFFFFF' 'C90FDAA2' '2168C234' 'C4C6628B' '80DC1CD1' '29024E08' '8A67CC74' '020BBEA6' '3B139B22'
+    '514A0879' '8E3404DD' 'EF9519B3' 'CD3A431B' '302B0A6D' 'F25F1437' '4FE1356D' '6D51C245' 'E485B576' '625E7EC6'
+    'F44C42E9' 'A637ED6B' '0BFF5CB6' 'F406B7ED' 'EE386BFB' '5A899FA5' 'AE9F2411' '7C4B1FE6' '49286651' 'ECE45B3D'
+    'C2007CB8' 'A163BF05' '98DA4836' '1C55D39A' '69163FA8' 'FD24CF5F' '83655D23' 'DCA3AD96' '1C62F356' '208552BB'
+    '9ED52907' '7096966D' '670C354E' '4ABC9804' 'F1746C08' 'CA18217C' '32905E46' '2E36CE3B' 'E39E772C' '180E8603'
+    '9B2783A2' 'EC07A28F' 'B5C55DF0' '6F4C52C9' 'DE2BCBF6' '95581718' '3995497C' 'EA956AE5' '15D22618' '98FA0510'
+    '15728E5A' '8AACAA68' 'FFFFFFFF' 'FFFFFFFF', 16)
+Q = (P - 1) // 2
+G = 2
+
+# Size of an encoded group element in bytes
+ELEMENT_LENGTH = 256
+
+# Secret exponents are drawn from [1, 2^EXPONENT_BITS), short exponents are enough for this group size
+EXPONENT_BITS = 256
+
+# Element of the subgroup whose discrete logarithm nobody knows: a hash of a fixed string, squared
+C = pow(int.from_bytes(SHAKE256.new(data=b'oblivious transfer constant').read(ELEMENT_LENGTH + 16), 'big') % P, 2, P)
+C_INVERSE = pow(C, -1, P)
+
+
+class FixedBase:
+    """
+    Exponentiation of a fixed base with precomputed powers.
+    table[j][d] = base^(d * 2^(WINDOW * j)), so base^e is the product of one table entry per
+    WINDOW bits of e, about EXPONENT_BITS / WINDOW multiplications instead of a full exponentiation.
+    """
+    WINDOW = 4
+
+    def __init__(self, base: int):
+        self.table = []
+        power = base
+        for _ in range(0, EXPONENT_BITS, self.WINDOW):
+            row = [1]
+            for _ in range((1 << self.WINDOW) - 1):
+                row.append(row[-1] * power % P)
+            self.table.append(row)
+            power = row[-1] * power % P
+
+    def pow(self, e: int) -> int:
+        if e >> EXPONENT_BITS:
+            raise ValueError("Exponent too large for the precomputed table")
+        result = 1
+        mask = (1 << self.WINDOW) - 1
+        for row in self.table:
+            if e & mask:
+                result = result * row[e & mask] % P
+            e >>= self.WINDOW
+            if not e:
+                break
+        return result
+
+
+@lru_cache(maxsize=None)
+def fixed_base(base: int) -> FixedBase:
+    """
+    Returns the precomputed table of a base, built on first use.
+    """
+    return FixedBase(base)
+
+
+def to_bytes(x: int) -> bytes:
+    return x.to_bytes(ELEMENT_LENGTH, 'big')
+
+
+def from_bytes(data) -> int:
+    """
+    Decodes a group element. Raises ValueError if it is not in [2, P - 1).
+    """
+    x = int.from_bytes(data, 'big')
+    if not 1 < x < P - 1:
+        raise ValueError("Invalid group element")
+    return x
@@ -0,0 +1,184 @@
+import os
+import struct
+
+from Crypto.Cipher import AES
+from Crypto.Hash import SHAKE128
+
+from oblivious_transfer.oblivious_transfer import ObliviousTransfer
+
+# Number of base OTs, and the size of the rows of the extension matrices in bits
+SECURITY_PARAMETER = 128
+SEED_LENGTH = 16
+
+# alice.py and bob.py switch to OT extension when Bob has at least this many terminals
+OT_EXTENSION_THRESHOLD = SECURITY_PARAMETER
+
+# Binary encoding of the extension messages (see OTExtension.serialize_matrix and serialize_ciphertexts)
+FORMAT_VERSION = 1
+MATRIX_HEADER = struct.Struct('!BII')       # version, number of columns, number of transfers
+CIPHERTEXTS_HEADER = struct.Struct('!BII')  # version, number of transfers, message length
+
+
+class OTExtension:
+    """
+    IKNP OT extension (Ishai, Kilian, Nissim, Petrank): m 1 out of 2 oblivious transfers from k base OTs.
+    Only the k base OTs use public key operations (see ObliviousTransfer, they run as one batch),
+    the m transfers only need a PRG and a hash, so m can be much larger than k at little cost.
+
+    Problem:
+        Alice has m pairs of messages (x_j^0, x_j^1) of the same length. Bob has m choice bits r_j.
+        Bob wants to learn x_j^{r_j} for every j without revealing r to Alice.
+
+    Functions:
+        alice_ext1():                                     Returns base OT keys and Alice's state
+        bob_ext1(choices, alice_keys):                    Returns base OT ciphertexts, matrix u and Bob's state
+        alice_ext2(messages, state, base_ciphertexts, u): Returns ciphertexts (y_j^0, y_j^1) for every transfer
+        bob_ext2(state, ciphertexts):                     Returns x_j^{r_j} for every transfer
+
+    Protocol:
+        1.  Alice picks k random bits s_i and acts as the receiver of k base OTs with choices s_i.
+            She calls alice_ext1() and sends the base OT keys to Bob.
+        2.  Bob acts as the sender of the base OTs, with random seed pairs (k_i^0, k_i^1) as messages.
+            With t_i = G(k_i^0) and u_i = t_i ^ G(k_i^1) ^ r, where G is a PRG expanding a seed to m bits,
+            he calls bob_ext1(choices, alice_keys) and sends the base OT ciphertexts and u to Alice.
+        3.  Alice learns k_i^{s_i} and computes q_i = G(k_i^{s_i}) ^ s_i * u_i = t_i ^ s_i * r.
+            Row j of the matrix q is then q_j = t_j ^ r_j * s. She calls alice_ext2 and sends
+            y_j^0 = x_j^0 ^ H(j, q_j) and y_j^1 = x_j^1 ^ H(j, q_j ^ s) to Bob.
+        4.  Bob calls bob_ext2 and learns x_j^{r_j} = y_j^{r_j} ^ H(j, t_j).
+            He does not know s, so he cannot compute the pad of the other message.
+
+    Column i of a matrix is an integer whose bit j is row j, row j is an integer whose bit i is column i.
+    This is secure against semi-honest parties.
+    """
+    def __init__(self, k=SECURITY_PARAMETER, workers=None):
+        self.k = k
+        self.ot = ObliviousTransfer(2, workers)
+
+    def alice_ext1(self):
+        s = [b & 1 for b in os.urandom(self.k)]
+        keys, sks = self.ot.bob_ot1_batch(s)
+        return keys, (s, sks)
+
+    def bob_ext1(self, choices, alice_keys):
+        if len(alice_keys) != self.k:
+            raise ValueError(f"Expected {self.k} base OT keys, got {len(alice_keys)}")
+
+        m = len(choices)
+        r = sum(int(c) << j for j, c in enumerate(choices))
+        seeds = [[os.urandom(SEED_LENGTH), os.urandom(SEED_LENGTH)] for _ in range(self.k)]
+        base_ciphertexts = self.ot.alice_ot1_batch(seeds, alice_keys)
+
+        t = [self._prg(k0, m) for k0, _ in seeds]
+        u = [t[i] ^ self._prg(k1, m) ^ r for i, (_, k1) in enumerate(seeds)]
+        return base_ciphertexts, u, (list(choices), self._transpose(t, m))
+
+    def alice_ext2(self, messages, state, base_ciphertexts, u):
+        s, sks = state
+        m = len(messages)
+        if len(base_ciphertexts) != self.k or len(u) != self.k:
+            raise ValueError(f"Expected {self.k} base OT ciphertexts and matrix columns")
+        if any(column >> m for column in u):
+            raise ValueError("Matrix columns have more rows than transfers")
+
+        seeds = self.ot.bob_ot2_batch(s, sks, base_ciphertexts)
+        q = [self._prg(seed, m) ^ (u[i] if s[i] else 0) for i, seed in enumerate(seeds)]
+
+        delta = sum(bit << i for i, bit in enumerate(s))
+        ciphertexts = []
+        for j, (row, (x0, x1)) in enumerate(zip(self._transpose(q, m), messages)):
+            if len(x0) != len(x1):
+                raise ValueError("Messages of a transfer must have the same length")
+            ciphertexts.append([self._xor(x0, self._hash(j, row, len(x0))),
+                                self._xor(x1, self._hash(j, row ^ delta, len(x1)))])
+        return ciphertexts
+
+    def bob_ext2(self, state, ciphertexts):
+        choices, rows = state
+        if len(ciphertexts) != len(choices):
+            raise ValueError("Incorrect number of ciphertexts")
+        return [self._xor(y[int(c)], self._hash(j, rows[j], len(y[int(c)])))
+                for j, (c, y) in enumerate(zip(choices, ciphertexts))]
+
+    def _prg(self, seed, m) -> int:
+        """
+        Expands a seed to m pseudorandom bits with AES-CTR.
+        """
+        stream = AES.new(seed, AES.MODE_CTR, nonce=b'').encrypt(bytes((m + 7) // 8))
+        return int.from_bytes(stream, 'big') & ((1 << m) - 1)
+
+    def _hash(self, j, row, n) -> bytes:
+        """
+        Hashes the index and a row of the matrix to n bytes.
+        """
+        data = j.to_bytes(8, 'big') + row.to_bytes((self.k + 7) // 8, 'big')
+        return SHAKE128.new(data=data).read(n)
+
+    @staticmethod
+    def _transpose(columns, m):
+        """
+        Turns the columns of a matrix with m rows into its rows.
+        """
+        if m == 0:
+            return []
+        # bits[i][j] is bit j of column i
+        bits = [format(column, f'0{m}b')[::-1] for column in columns]
+        return [int(''.join(row)[::-1], 2) for row in zip(*bits)]
+
+    @staticmethod
+    def _xor(a: bytes, b: bytes) -> bytes:
+        return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
+
+    @staticmethod
+    def serialize_matrix(u, m) -> bytes:
+        """
+        Binary encoding of the matrix u of bob_ext1: the header (MATRIX_HEADER) and every column
+        as (m + 7) // 8 big-endian bytes.
+        """
+        length = (m + 7) // 8
+        return b''.join([MATRIX_HEADER.pack(FORMAT_VERSION, len(u), m)] + [column.to_bytes(length, 'big') for column in u])
+
+    @staticmethod
+    def deserialize_matrix(buffer):
+        """
+        Returns (u, m). Raises ValueError if the encoding is malformed.
+        """
+        view = memoryview(buffer)
+        if len(view) < MATRIX_HEADER.size:
+            raise ValueError("Truncated OT extension matrix")
+        version, k, m = MATRIX_HEADER.unpack_from(view, 0)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported OT extension format version: {version}")
+        length = (m + 7) // 8
+        if len(view) != MATRIX_HEADER.size + k * length:
+            raise ValueError("OT extension matrix length does not match its header")
+        offset = MATRIX_HEADER.size
+        return [int.from_bytes(view[offset + i * length:offset + (i + 1) * length], 'big') for i in range(k)], m
+
+    @staticmethod
+    def serialize_ciphertexts(ciphertexts) -> bytes:
+        """
+        Binary encoding of the result of alice_ext2: the header (CIPHERTEXTS_HEADER) and the ciphertexts
+        y_0^0, y_0^1, y_1^0, ... back to back. All messages must have the same length.
+        """
+        n = len(ciphertexts[0][0]) if ciphertexts else 0
+        if any(len(y) != n for pair in ciphertexts for y in pair):
+            raise ValueError("All OT extension messages must have the same length")
+        return b''.join([CIPHERTEXTS_HEADER.pack(FORMAT_VERSION, len(ciphertexts), n)] +
+                        [y for pair in ciphertexts for y in pair])
+
+    @staticmethod
+    def deserialize_ciphertexts(buffer):
+        """
+        Decodes serialize_ciphertexts. Raises ValueError if the encoding is malformed.
+        """
+        view = memoryview(buffer)
+        if len(view) < CIPHERTEXTS_HEADER.size:
+            raise ValueError("Truncated OT extension ciphertexts")
+        version, m, n = CIPHERTEXTS_HEADER.unpack_from(view, 0)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported OT extension format version: {version}")
+        if len(view) != CIPHERTEXTS_HEADER.size + 2 * m * n:
+            raise ValueError("OT extension ciphertexts length does not match their header")
+        offset = CIPHERTEXTS_HEADER.size
+        return [[bytes(view[offset + (2 * j + b) * n:offset + (2 * j + b + 1) * n]) for b in range(2)]
+                for j in range(m)]
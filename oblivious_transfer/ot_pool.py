@@ -0,0 +1,271 @@
+import fcntl
+import os
+import struct
+import time
+
+# Roles of the parties in a pool
+SENDER = 0    # Alice, holds random message pairs (r_0, r_1)
+RECEIVER = 1  # Bob, holds a random choice bit d and r_d
+
+# Batch file: header followed by count records.
+# A sender record is r_0 || r_1, a receiver record is d (one byte) || r_d.
+FORMAT_VERSION = 1
+MAGIC = b'OTPL'
+BATCH_HEADER = struct.Struct('!4sBBHQQ')  # magic, version, role, message length, count, used
+USED = struct.Struct('!Q')
+USED_OFFSET = BATCH_HEADER.size - USED.size
+BATCH_ID_LENGTH = 16
+BATCH_SUFFIX = '.otpool'
+LOCK_FILE = 'lock'
+
+# Encoding of the segments of a pool used for a set of transfers
+SEGMENTS_HEADER = struct.Struct('!BI')  # version, number of segments
+SEGMENT = struct.Struct(f'!{BATCH_ID_LENGTH}sQI')  # batch id, start, count
+
+
+class OTPool:
+    """
+    Random OTs precomputed in an offline phase and stored in a directory, one file per batch.
+
+    A random OT is a 1 out of 2 oblivious transfer of random messages: the sender gets (r_0, r_1),
+    the receiver gets a random bit d and r_d. Both parties store the same batches of random OTs, identified
+    by a batch id, and consume them in order. Every random OT must be used at most once:
+    take and take_segments mark the entries as used on disk before returning them,
+    and fully used batch files are deleted.
+
+        pool.add(batch_id, entries)         stores a batch of random OTs (see new_batch_id)
+        pool.depth()                        number of unused random OTs
+        pool.take(count)                    receiver: the next count unused random OTs and their segments
+        pool.take_segments(segments)        sender: the random OTs of the segments chosen by the receiver
+
+    A segment (batch id, start, count) is a range of entries of a batch. The receiver decides which entries
+    are used, the sender only accepts entries after the ones it has already used, so it never uses one twice.
+    An exclusive lock on the directory serializes processes sharing a pool.
+    The random OTs are secret: the directory is only accessible and the batch files only readable by their owner,
+    and the records of used entries are overwritten with zeros.
+    """
+    def __init__(self, path, role):
+        if role not in [SENDER, RECEIVER]:
+            raise ValueError(f"Invalid OT pool role: {role}")
+        self.path = path
+        self.role = role
+        os.makedirs(path, 0o700, exist_ok=True)
+
+    @staticmethod
+    def new_batch_id() -> bytes:
+        """
+        Batch ids start with a timestamp, so batches are consumed in the order they were created.
+        """
+        return time.time_ns().to_bytes(8, 'big') + os.urandom(BATCH_ID_LENGTH - 8)
+
+    def add(self, batch_id: bytes, entries):
+        """
+        Stores a batch. entries are (r_0, r_1) pairs for the sender and (d, r_d) pairs for the receiver.
+        """
+        if len(batch_id) != BATCH_ID_LENGTH:
+            raise ValueError("Invalid batch id")
+        length = len(entries[0][1]) if entries else 0
+        records = []
+        for first, second in entries:
+            if self.role == SENDER:
+                records.append(first + second)
+            else:
+                records.append(bytes([int(first)]) + second)
+        if any(len(record) != len(records[0]) for record in records):
+            raise ValueError("All messages of a batch must have the same length")
+
+        path = self._batch_path(batch_id)
+        with self._lock():
+            if os.path.exists(path):
+                raise ValueError(f"Batch {batch_id.hex()} already exists")
+            fd = os.open(path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(BATCH_HEADER.pack(MAGIC, FORMAT_VERSION, self.role, length, len(entries), 0))
+                f.write(b''.join(records))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+
+    def depth(self) -> int:
+        with self._lock():
+            return sum(count - used for _, _, count, used in map(self._read_header, self._batches()))
+
+    def take(self, count):
+        """
+        Takes the next count unused random OTs. Returns (segments, entries).
+        Raises ValueError if the pool has fewer than count unused random OTs.
+        """
+        with self._lock():
+            segments = []
+            missing = count
+            for batch_id in self._batches():
+                if not missing:
+                    break
+                _, _, batch_count, used = self._read_header(batch_id)
+                n = min(missing, batch_count - used)
+                if n:
+                    segments.append((batch_id, used, n))
+                    missing -= n
+            if missing:
+                raise ValueError(f"OT pool {self.path} has {count - missing} unused random OTs, {count} are needed")
+            return segments, self._consume(segments)
+
+    def take_segments(self, segments):
+        """
+        Takes the random OTs of the given segments, which must all be after the entries used so far.
+        Entries skipped in between are discarded.
+        """
+        with self._lock():
+            ends = {}
+            for batch_id, start, count in segments:
+                if not os.path.exists(self._batch_path(batch_id)):
+                    raise ValueError(f"Unknown OT pool batch {batch_id.hex()}")
+                _, _, batch_count, used = self._read_header(batch_id)
+                if start < max(used, ends.get(batch_id, 0)) or start + count > batch_count:
+                    raise ValueError(f"Segment {start}..{start + count} of batch {batch_id.hex()} is not available")
+                ends[batch_id] = start + count
+            return self._consume(segments)
+
+    def _consume(self, segments):
+        """
+        Marks the segments as used, then reads their entries and overwrites them with zeros.
+        Must be called with the lock held.
+        """
+        for batch_id, start, count in segments:
+            with open(self._batch_path(batch_id), 'r+b') as f:
+                f.seek(USED_OFFSET)
+                f.write(USED.pack(start + count))
+                f.flush()
+                os.fsync(f.fileno())
+
+        entries = []
+        for batch_id, start, count in segments:
+            path = self._batch_path(batch_id)
+            _, length, batch_count, used = self._read_header(batch_id)
+            size = 2 * length if self.role == SENDER else 1 + length
+            with open(path, 'r+b') as f:
+                f.seek(BATCH_HEADER.size + start * size)
+                data = f.read(count * size)
+                f.seek(BATCH_HEADER.size + start * size)
+                f.write(bytes(len(data)))
+                f.flush()
+                os.fsync(f.fileno())
+            for i in range(0, len(data), size):
+                record = data[i:i + size]
+                if self.role == SENDER:
+                    entries.append((record[:length], record[length:]))
+                else:
+                    entries.append((record[0], record[1:]))
+            if used == batch_count:
+                os.remove(path)
+        return entries
+
+    def _read_header(self, batch_id):
+        with open(self._batch_path(batch_id), 'rb') as f:
+            magic, version, role, length, count, used = BATCH_HEADER.unpack(f.read(BATCH_HEADER.size))
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"Invalid OT pool batch {batch_id.hex()}")
+        if role != self.role:
+            raise ValueError(f"OT pool batch {batch_id.hex()} belongs to the other party")
+        return role, length, count, used
+
+    def _batches(self):
+        return sorted(bytes.fromhex(name[:-len(BATCH_SUFFIX)]) for name in os.listdir(self.path)
+                      if name.endswith(BATCH_SUFFIX))
+
+    def _batch_path(self, batch_id):
+        return os.path.join(self.path, batch_id.hex() + BATCH_SUFFIX)
+
+    def _lock(self):
+        return _DirectoryLock(os.path.join(self.path, LOCK_FILE))
+
+    @staticmethod
+    def serialize_segments(segments) -> bytes:
+        return b''.join([SEGMENTS_HEADER.pack(FORMAT_VERSION, len(segments))] +
+                        [SEGMENT.pack(batch_id, start, count) for batch_id, start, count in segments])
+
+    @staticmethod
+    def deserialize_segments(buffer):
+        """
+        Returns (segments, rest) where rest is the part of buffer after the segments.
+        Raises ValueError if the encoding is malformed.
+        """
+        view = memoryview(buffer)
+        if len(view) < SEGMENTS_HEADER.size:
+            raise ValueError("Truncated OT pool segments")
+        version, n = SEGMENTS_HEADER.unpack_from(view, 0)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported OT pool format version: {version}")
+        end = SEGMENTS_HEADER.size + n * SEGMENT.size
+        if len(view) < end:
+            raise ValueError("Truncated OT pool segments")
+        segments = [SEGMENT.unpack_from(view, SEGMENTS_HEADER.size + i * SEGMENT.size) for i in range(n)]
+        return segments, view[end:]
+
+
+class PrecomputedOT:
+    """
+    1 out of 2 oblivious transfers from precomputed random OTs (Beaver): only XORs in the online phase.
+
+    Functions:
+        bob_ot1(choices, entries):                  Returns the corrections e_j = c_j ^ d_j
+        alice_ot1(messages, entries, corrections):  Returns ciphertexts (y_j^0, y_j^1)
+        bob_ot2(choices, entries, ciphertexts):     Returns x_j^{c_j} for every transfer
+
+    Protocol:
+        1.  Bob has choice bits c_j and random OTs (d_j, r_j). He sends e_j = c_j ^ d_j to Alice.
+            e_j is uniformly random, so it does not reveal c_j.
+        2.  Alice has messages (x_j^0, x_j^1) and random OTs (r_j^0, r_j^1).
+            She sends y_j^b = x_j^b ^ r_j^{b ^ e_j} for b in 0, 1.
+        3.  Bob learns x_j^{c_j} = y_j^{c_j} ^ r_j, because c_j ^ e_j = d_j. The other message is
+            encrypted with r_j^{1 - d_j}, which he does not know.
+    """
+    @staticmethod
+    def bob_ot1(choices, entries):
+        if len(choices) != len(entries):
+            raise ValueError("Incorrect number of random OTs")
+        return [int(c) ^ d for c, (d, _) in zip(choices, entries)]
+
+    @staticmethod
+    def alice_ot1(messages, entries, corrections):
+        if len(messages) != len(entries) or len(corrections) != len(entries):
+            raise ValueError("Incorrect number of random OTs or corrections")
+        xor = PrecomputedOT._xor
+        return [[xor(x0, r[e]), xor(x1, r[1 ^ e])] for (x0, x1), r, e in zip(messages, entries, corrections)]
+
+    @staticmethod
+    def bob_ot2(choices, entries, ciphertexts):
+        if len(ciphertexts) != len(entries):
+            raise ValueError("Incorrect number of ciphertexts")
+        return [PrecomputedOT._xor(y[int(c)], r) for c, (_, r), y in zip(choices, entries, ciphertexts)]
+
+    @staticmethod
+    def serialize_corrections(corrections) -> bytes:
+        return sum(e << j for j, e in enumerate(corrections)).to_bytes((len(corrections) + 7) // 8, 'little')
+
+    @staticmethod
+    def deserialize_corrections(buffer, count):
+        if len(buffer) != (count + 7) // 8:
+            raise ValueError("Corrections length does not match the number of transfers")
+        bits = int.from_bytes(buffer, 'little')
+        return [bits >> j & 1 for j in range(count)]
+
+    @staticmethod
+    def _xor(a: bytes, b: bytes) -> bytes:
+        if len(a) != len(b):
+            raise ValueError("Message and random OT lengths differ")
+        return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
+
+
+class _DirectoryLock:
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
@@ -0,0 +1,67 @@
+"""
+Offline phase of the oblivious transfers: fills the pools of precomputed random OTs used by
+alice.py and bob.py with --ot-pool=DIR, and reports how many unused random OTs they hold.
+
+Usage:
+    python ot_pool.py fill-bob <port> <pool_dir> [--verbose] [--ot-extension-threshold=N]
+    python ot_pool.py fill-alice <bob_host> <bob_port> <pool_dir> <count> [--verbose] [--ot-extension-threshold=N]
+    python ot_pool.py depth <pool_dir> <alice|bob>
+
+fill-bob waits for fill-alice to connect. Together they run count oblivious transfers of random messages
+and both store the result as a new batch in their pool. Every run of alice.py and bob.py with --ot-pool
+consumes one random OT per Bob terminal.
+"""
+
+import os
+import struct
+import sys
+
+import alice
+import bob
+from common import log, send_message, read_expected_message, get_option, MESSAGE_OT_POOL_BATCH
+from garbled_circuits.garbled_gate import PASSWORD_LENGTH
+from oblivious_transfer.ot_extension import OT_EXTENSION_THRESHOLD
+from oblivious_transfer.ot_pool import OTPool, SENDER, RECEIVER, BATCH_ID_LENGTH
+
+BATCH = struct.Struct(f'!{BATCH_ID_LENGTH}sQ')  # batch id, number of random OTs
+
+def usage():
+    log(__doc__)
+    sys.exit(1)
+
+def fill_alice(bob_host, bob_port, pool, count, ot_threshold, verbose=False):
+    connection = alice.get_connection(bob_host, bob_port)
+    batch_id = OTPool.new_batch_id()
+    send_message(connection, MESSAGE_OT_POOL_BATCH, BATCH.pack(batch_id, count), verbose)
+
+    messages = {j: [os.urandom(PASSWORD_LENGTH), os.urandom(PASSWORD_LENGTH)] for j in range(count)}
+    alice.send_passwords(connection, messages, list(range(count)), ot_threshold, verbose=verbose)
+    pool.add(batch_id, [messages[j] for j in range(count)])
+    log(f"Added {count} random OTs to {pool.path}, depth {pool.depth()}")
+
+def fill_bob(port, pool, ot_threshold, verbose=False):
+    connection = bob.get_connection(port)
+    batch_id, count = BATCH.unpack(read_expected_message(connection, MESSAGE_OT_POOL_BATCH, verbose=verbose))
+
+    choices = {j: b & 1 for j, b in enumerate(os.urandom(count))}
+    messages = bob.receive_passwords(connection, choices, ot_threshold, verbose=verbose)
+    pool.add(batch_id, [(choices[j], messages[j]) for j in range(count)])
+    log(f"Added {count} random OTs to {pool.path}, depth {pool.depth()}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        usage()
+    command = sys.argv[1]
+    verbose = '--verbose' in sys.argv
+    ot_threshold = int(get_option('ot-extension-threshold', OT_EXTENSION_THRESHOLD))
+
+    if command == 'fill-alice' and len(sys.argv) >= 6:
+        fill_alice(sys.argv[2], int(sys.argv[3]), OTPool(sys.argv[4], SENDER), int(sys.argv[5]), ot_threshold, verbose)
+    elif command == 'fill-bob' and len(sys.argv) >= 4:
+        fill_bob(int(sys.argv[2]), OTPool(sys.argv[3], RECEIVER), ot_threshold, verbose)
+    elif command == 'depth' and len(sys.argv) >= 4 and sys.argv[3] in ['alice', 'bob']:
+        pool = OTPool(sys.argv[2], SENDER if sys.argv[3] == 'alice' else RECEIVER)
+        log(f"{pool.path}: {pool.depth()} unused random OTs")
+    else:
+        usage()
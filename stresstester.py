@@ -6,12 +6,13 @@ For each possible assignment of the inputs, the script will calculate the output
 If the outputs differ, it will print the assignment and the outputs and exit.
 
 Usage:
-    python stresstester.py <testcase_folder> <port> [iterations]
+    python stresstester.py <testcase_folder> <port> [iterations] [--circuit-cache=DIR]
 
 <testcase_folder> contains the circuit file as circuit.txt.
 <port> is the port number to use for the garbled circuit protocol.
 if iterations is provided, it will only generate that many random assignments and check them.
 Otherwise, it will check all possible assignments.
+With --circuit-cache, the circuit is only parsed once for all runs of alice.py and bob.py (see common.load_circuit_from_file).
 """
 
 import os, tqdm
@@ -20,18 +21,20 @@ import sys
 from itertools import product
 import random
 from timeit import default_timer as timer
-from common import load_circuit_from_file
+from common import load_circuit_from_file, get_option
 
 def handle_args():
-    if len(sys.argv) < 3:
-        print("Usage: python stresstester.py <testcase_folder> <port> [iterations]")
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if len(args) < 2:
+        print("Usage: python stresstester.py <testcase_folder> <port> [iterations] [--circuit-cache=DIR]")
         exit(1)
 
-    testcase_folder = sys.argv[1]
-    port = int(sys.argv[2])
-    iterations = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    testcase_folder = args[0]
+    port = int(args[1])
+    iterations = int(args[2]) if len(args) > 2 else None
+    circuit_cache = get_option('circuit-cache')
 
-    return testcase_folder, port, iterations
+    return testcase_folder, port, iterations, circuit_cache
 
 def setup_temp_folder(testcase_folder):
     temp_folder = "./temp/"
@@ -45,19 +48,28 @@ def setup_temp_folder(testcase_folder):
     return temp_folder
 
 
-testcase_folder, port, iterations = handle_args()
+testcase_folder, port, iterations, circuit_cache = handle_args()
 temp_folder = setup_temp_folder(testcase_folder)
 circuit_file = os.path.join(temp_folder, "circuit.txt")
 alice_file = os.path.join(temp_folder, "alice.txt")
 bob_file = os.path.join(temp_folder, "bob.txt")
-circuit, alice_terminals, bob_terminals = load_circuit_from_file(circuit_file)
+# The reference outputs come from the circuit as written, alice.py and bob.py run the optimized one
+circuit, alice_terminals, bob_terminals = load_circuit_from_file(circuit_file, optimize=False, cache_dir=circuit_cache)
+cache_option = f"--circuit-cache={circuit_cache}" if circuit_cache else ""
+
+
+# Outputs for every assignment, computed in a single bit-sliced pass over the circuit.
+truth_table = circuit.compiled.truth_table()
+terminal_index = {t: i for i, t in enumerate(circuit.compiled.terminals)}
 
 
 def brute(assignment):
-    simplified = circuit.simplify(assignment)
-    if not simplified in [True, False]:
-        raise ValueError(f"Simplified circuit {simplified} is not a boolean value")
-    return simplified
+    if len(assignment) != len(terminal_index):
+        raise ValueError("Assignment does not assign all terminals of the circuit")
+    row = sum(1 << terminal_index[t] for t, v in assignment.items() if v)
+    values = [bool(table >> row & 1) for table in truth_table]
+    # Same as Circuit.simplify: a single output is a boolean
+    return values[0] if len(values) == 1 else values
 
 def setup_files(assignment):
     with open(alice_file, 'w') as alice, open(bob_file, 'w') as bob:
@@ -71,17 +83,20 @@ def setup_files(assignment):
 
 def protocol(assignment):
     setup_files(assignment)
-    os.system(f"python alice.py localhost {port} {circuit_file} {alice_file} > alice.temp &")
-    os.system(f"python bob.py {port} {circuit_file} {bob_file} > bob.temp")
+    os.system(f"python alice.py localhost {port} {circuit_file} {alice_file} {cache_option} > alice.temp &")
+    os.system(f"python bob.py {port} {circuit_file} {bob_file} {cache_option} > bob.temp")
 
     with open("bob.temp", 'r') as f:
         lines = f.readlines()
-        all_tokens = [token for line in lines for token in line.split()]
-        last_token = all_tokens[-1]
-
-        if last_token.lower() not in ['true', 'false']:
-            raise ValueError(f"Invalid output from Bob: {last_token}")
-    return last_token.lower() == 'true'
+        output_lines = [line for line in lines if 'Output:' in line]
+        if not output_lines:
+            raise ValueError("No output from Bob")
+        tokens = output_lines[-1].split('Output:')[-1].split()
+
+        if not tokens or any(token.lower() not in ['true', 'false'] for token in tokens):
+            raise ValueError(f"Invalid output from Bob: {output_lines[-1].strip()}")
+    values = [token.lower() == 'true' for token in tokens]
+    return values[0] if len(values) == 1 else values
 
 
 def check(actual, calculated):